@@ -1,118 +1,165 @@
 import os
+from dataclasses import dataclass
+from functools import lru_cache
 from pathlib import Path
 
 # -----------------------------
 # Base paths
 # -----------------------------
-BASE_DIR = Path(__file__).resolve().parent.parent  # project root: vm-manager/
+# project root: vm-manager/. Deployments can set VM_MANAGER_BASE_DIR to skip
+# resolving (realpath) this file's location on every process start.
+BASE_DIR = Path(os.environ.get("VM_MANAGER_BASE_DIR") or Path(__file__).resolve().parent.parent)
+_BASE_STR = os.fspath(BASE_DIR)
 
 # -----------------------------
 # VM image storage inside the project
 # -----------------------------
 VM_IMAGES_ROOT = BASE_DIR / "vm-images"
-VM_IMAGES_ROOT.mkdir(parents=True, exist_ok=True)
 
 # base image folder
 BASE_IMAGE_DIR = VM_IMAGES_ROOT / "base"
-BASE_IMAGE_DIR.mkdir(parents=True, exist_ok=True)
 BASE_IMAGE_PATH = BASE_IMAGE_DIR / "base.qcow2"
 
 # per-VM disks (students + pool)
 VM_STORAGE_PATH = VM_IMAGES_ROOT / "instances"
-VM_STORAGE_PATH.mkdir(parents=True, exist_ok=True)
 
 # Backup directory (incremental snapshots)
 BACKUP_DIR = VM_IMAGES_ROOT / "backups"
-BACKUP_DIR.mkdir(parents=True, exist_ok=True)
 
 # -----------------------------
 # Logging
 # -----------------------------
 LOG_DIR = BASE_DIR / "log"
-LOG_DIR.mkdir(parents=True, exist_ok=True)
-
 LOG_FILE = LOG_DIR / "vm-manager.log"
 
 # SSH session recordings (asciinema-like .cast files)
 SSH_LOG_DIR = LOG_DIR / "ssh-sessions"
-SSH_LOG_DIR.mkdir(parents=True, exist_ok=True)
-
-# -----------------------------
-# VM defaults
-# -----------------------------
-DEFAULT_MEMORY_MB = int(os.getenv("VM_DEFAULT_MEMORY_MB", "1024"))
-DEFAULT_VCPU = int(os.getenv("VM_DEFAULT_VCPU", "1"))
-
-# Hot VM pool
-HOT_VM_POOL_SIZE = int(os.getenv("HOT_VM_POOL_SIZE", "3"))
-
-# -----------------------------
-# Hypervisor / libvirt
-# -----------------------------
-HYPERVISOR_TYPE = os.getenv("HYPERVISOR_TYPE", "qemu").lower()
-
-# common examples:
-#   qemu:///system                  (KVM/QEMU on host)
-#   xen:///system                   (Xen)
-#   vpx:///system                   (VMware vSphere/ESXi)
-#   hyperv:///system                (Hyper-V)
-#   qemu+ssh://root@proxmox/system  (Proxmox)
-LIBVIRT_URI = os.getenv("LIBVIRT_URI", "qemu:///system")
-
-HYPERVISOR_CONFIG = {
-    "qemu": {
-        "uri": os.getenv("LIBVIRT_QEMU_URI", LIBVIRT_URI),
-    },
-    "kvm": {
-        "uri": os.getenv("LIBVIRT_KVM_URI", LIBVIRT_URI),
-    },
-    "hyperv": {
-        "uri": os.getenv("LIBVIRT_HYPERV_URI", LIBVIRT_URI),
-    },
-    "vmware": {
-        "uri": os.getenv("LIBVIRT_VMWARE_URI", LIBVIRT_URI),
-    },
-    "xen": {
-        "uri": os.getenv("LIBVIRT_XEN_URI", LIBVIRT_URI),
-    },
-    "proxmox": {
-        "uri": os.getenv("LIBVIRT_PROXMOX_URI", LIBVIRT_URI),
-    },
-}
-
-# -----------------------------
-# Automation / Ansible
-# -----------------------------
-ANSIBLE_HOSTS_FILE = os.getenv(
-    "ANSIBLE_HOSTS_FILE",
-    str(BASE_DIR / "ansible" / "hosts.ini"),
-)
 
-ANSIBLE_PLAYBOOK = os.getenv(
-    "ANSIBLE_PLAYBOOK",
-    str(BASE_DIR / "ansible" / "playbooks" / "configure_vm.yml"),
-)
-
-# -----------------------------
-# SSH / terminal access
-# -----------------------------
-VM_SSH_HOST_TEMPLATE = os.getenv("VM_SSH_HOST_TEMPLATE", "{name}")
-VM_SSH_PORT = int(os.getenv("VM_SSH_PORT", "22"))
-VM_SSH_USERNAME = os.getenv("VM_SSH_USERNAME", "student")
-VM_SSH_KNOWN_HOSTS = os.getenv("VM_SSH_KNOWN_HOSTS", None)
-
-VM_SSH_PRIVATE_KEY = os.getenv(
-    "VM_SSH_PRIVATE_KEY",
-    str(Path.home() / ".ssh" / "id_rsa"),
-)
-
-# -----------------------------
-# Metrics / monitoring
-# -----------------------------
-METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() == "true"
-METRICS_REFRESH_INTERVAL = int(os.getenv("METRICS_REFRESH_INTERVAL", "5"))
-
-# -----------------------------
-# Misc
-# -----------------------------
-DEBUG = os.getenv("DEBUG", "true").lower() == "true"
+# Create all required directories once per process; reloads skip the syscalls.
+if not globals().get("_DIRS_READY"):
+    for _dir in (VM_IMAGES_ROOT, BASE_IMAGE_DIR, VM_STORAGE_PATH, BACKUP_DIR, LOG_DIR, SSH_LOG_DIR):
+        _dir.mkdir(parents=True, exist_ok=True)
+    _DIRS_READY = True
+
+
+@dataclass(frozen=True, slots=True)
+class Settings:
+    """
+    Environment-driven settings, parsed exactly once per process.
+
+    Module-level names (e.g. ``DEFAULT_MEMORY_MB``) are resolved lazily
+    through ``__getattr__`` below, so ``from config.settings import X``
+    keeps working while int()/lower() conversions happen a single time.
+    """
+
+    # VM defaults
+    default_memory_mb: int
+    default_vcpu: int
+
+    # Hot VM pool
+    hot_vm_pool_size: int
+
+    # Hypervisor / libvirt
+    hypervisor_type: str
+    libvirt_uri: str
+    hypervisor_config: dict
+    libvirt_pool_size: int
+    use_io_uring: bool
+    use_backing_file: bool
+
+    # Automation / Ansible
+    ansible_hosts_file: str
+    ansible_playbook: str
+    ansible_forks: int
+    ansible_timeout: int
+    guest_agent_timeout: float
+
+    # SSH / terminal access
+    vm_ssh_host_template: str
+    vm_ssh_port: int
+    vm_ssh_username: str
+    vm_ssh_known_hosts: str | None
+    vm_ssh_private_key: str
+    ssh_pool_idle_timeout: float
+
+    # Metrics / monitoring
+    metrics_enabled: bool
+    metrics_refresh_interval: int
+
+    # Misc
+    debug: bool
+
+
+def _kernel_supports_io_uring() -> bool:
+    """
+    io_uring landed in Linux 5.1. This probes the kernel vm-manager runs on,
+    which is the hypervisor host for local (qemu:///system) URIs.
+    """
+    try:
+        major, minor = (int(part) for part in os.uname().release.split(".")[:2])
+    except (AttributeError, ValueError):
+        return False
+    return (major, minor) >= (5, 1)
+
+
+@lru_cache(maxsize=1)
+def _settings() -> Settings:
+    env = dict(os.environ)
+
+    # common examples:
+    #   qemu:///system                  (KVM/QEMU on host)
+    #   xen:///system                   (Xen)
+    #   vpx:///system                   (VMware vSphere/ESXi)
+    #   hyperv:///system                (Hyper-V)
+    #   qemu+ssh://root@proxmox/system  (Proxmox)
+    libvirt_uri = env.get("LIBVIRT_URI", "qemu:///system")
+
+    return Settings(
+        default_memory_mb=int(env.get("VM_DEFAULT_MEMORY_MB", "1024")),
+        default_vcpu=int(env.get("VM_DEFAULT_VCPU", "1")),
+        hot_vm_pool_size=int(env.get("HOT_VM_POOL_SIZE", "3")),
+        hypervisor_type=env.get("HYPERVISOR_TYPE", "qemu").lower(),
+        libvirt_uri=libvirt_uri,
+        hypervisor_config={
+            hv: {"uri": env.get(f"LIBVIRT_{hv.upper()}_URI", libvirt_uri)}
+            for hv in ("qemu", "kvm", "hyperv", "vmware", "xen", "proxmox")
+        },
+        libvirt_pool_size=int(env.get("LIBVIRT_POOL_SIZE", "8")),
+        use_io_uring=(
+            env["USE_IO_URING"].lower() == "true" if "USE_IO_URING" in env else _kernel_supports_io_uring()
+        ),
+        use_backing_file=env.get("USE_BACKING_FILE", "true").lower() == "true",
+        ansible_hosts_file=env.get(
+            "ANSIBLE_HOSTS_FILE",
+            os.path.join(_BASE_STR, "ansible", "hosts.ini"),
+        ),
+        ansible_playbook=env.get(
+            "ANSIBLE_PLAYBOOK",
+            os.path.join(_BASE_STR, "ansible", "playbooks", "configure_vm.yml"),
+        ),
+        ansible_forks=int(env.get("ANSIBLE_FORKS", "10")),
+        ansible_timeout=int(env.get("ANSIBLE_TIMEOUT", "1800")),
+        guest_agent_timeout=float(env.get("GUEST_AGENT_TIMEOUT", "300")),
+        vm_ssh_host_template=env.get("VM_SSH_HOST_TEMPLATE", "{name}"),
+        vm_ssh_port=int(env.get("VM_SSH_PORT", "22")),
+        vm_ssh_username=env.get("VM_SSH_USERNAME", "student"),
+        vm_ssh_known_hosts=env.get("VM_SSH_KNOWN_HOSTS", None),
+        vm_ssh_private_key=env.get(
+            "VM_SSH_PRIVATE_KEY",
+            os.path.join(os.path.expanduser("~"), ".ssh", "id_rsa"),
+        ),
+        ssh_pool_idle_timeout=float(env.get("SSH_POOL_IDLE_TIMEOUT", "60")),
+        metrics_enabled=env.get("METRICS_ENABLED", "true").lower() == "true",
+        metrics_refresh_interval=int(env.get("METRICS_REFRESH_INTERVAL", "5")),
+        debug=env.get("DEBUG", "true").lower() == "true",
+    )
+
+
+def __getattr__(name: str):
+    # Only upper-case names map onto Settings fields (DEFAULT_VCPU -> default_vcpu)
+    if name.isupper():
+        try:
+            return getattr(_settings(), name.lower())
+        except AttributeError:
+            pass
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
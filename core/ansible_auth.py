@@ -1,31 +1,68 @@
+import ctypes
+import mmap
 from typing import Optional
-from threading import Lock
+
+# One page holds the secret; more than enough for any sudo password.
+PASSWORD_BUFFER_SIZE = mmap.PAGESIZE
+
+
+def _lock_in_memory(buf: mmap.mmap) -> None:
+    # Best effort: keep the page out of swap and core dumps. mlock can fail
+    # under a low RLIMIT_MEMLOCK (or without libc), in which case the
+    # password is still kept out of Python str objects.
+    try:
+        addr = ctypes.addressof(ctypes.c_char.from_buffer(buf))
+        ctypes.CDLL(None, use_errno=True).mlock(ctypes.c_void_p(addr), ctypes.c_size_t(len(buf)))
+    except (OSError, AttributeError):
+        pass
+    try:
+        buf.madvise(mmap.MADV_DONTDUMP)
+    except (OSError, AttributeError):
+        pass
 
 
 class AnsibleAuthManager:
     """
     Simple in-memory storage for Ansible sudo/become password.
 
-    - Password is stored only in process memory (not on disk).
+    - Password is stored only in process memory (not on disk), in a
+      dedicated mlock'ed page rather than a Python str, so it is not
+      swapped out and can be wiped in place.
     - Not logged anywhere.
     - If no password is set, Ansible will run without become_pass, which
       works on hosts with passwordless sudo.
     """
 
-    _password: Optional[str] = None
-    _lock: Lock = Lock()
+    # Only touched from the event loop (API handlers and the async Ansible
+    # runner), so no lock is needed.
+    _buffer: Optional[mmap.mmap] = None
+    _length: int = 0
+
+    @classmethod
+    def _page(cls) -> mmap.mmap:
+        if cls._buffer is None:
+            cls._buffer = mmap.mmap(-1, PASSWORD_BUFFER_SIZE)
+            _lock_in_memory(cls._buffer)
+        return cls._buffer
 
     @classmethod
     def set_password(cls, password: str) -> None:
-        with cls._lock:
-            cls._password = password
+        data = password.encode()
+        if len(data) > PASSWORD_BUFFER_SIZE:
+            raise ValueError(f"password longer than {PASSWORD_BUFFER_SIZE} bytes")
+        cls.clear_password()
+        cls._page()[: len(data)] = data
+        cls._length = len(data)
 
     @classmethod
     def clear_password(cls) -> None:
-        with cls._lock:
-            cls._password = None
+        if cls._length:
+            cls._buffer[: cls._length] = bytes(cls._length)
+            cls._length = 0
 
     @classmethod
     def get_password(cls) -> Optional[str]:
-        with cls._lock:
-            return cls._password
+        """Decoded copy of the password (for the Ansible environment)."""
+        if not cls._length:
+            return None
+        return cls._buffer[: cls._length].decode()
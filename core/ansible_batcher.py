@@ -0,0 +1,73 @@
+import asyncio
+from typing import Optional
+
+from fastapi import HTTPException
+
+from core.logger import log_event
+
+
+class AnsibleBatcher:
+    """
+    Coalesces Ansible configuration requests into batched playbook runs.
+
+    VM names submitted within `window_sec` of each other are configured by a
+    single VMController.configure_vm_with_ansible() call, i.e. one
+    ansible-playbook process. Each caller awaits the outcome for its own VM:
+    a host failing in the playbook only fails that VM's caller, while a run
+    that fails as a whole fails the entire batch.
+    """
+
+    def __init__(self, vm_controller, window_sec: float = 0.2) -> None:
+        self.vm_controller = vm_controller
+        self.window_sec = window_sec
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+
+    async def configure(self, vm_name: str) -> None:
+        """
+        Configure `vm_name` as part of the next batch. Raises HTTPException
+        if the playbook failed on this VM, or whatever the batched
+        configure_vm_with_ansible() call raised.
+        """
+        if self._worker is None or self._worker.done():
+            self._queue = asyncio.Queue()
+            self._worker = asyncio.create_task(self._run())
+
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((vm_name, future))
+        await future
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            # Block for the first request, then collect whatever else arrives
+            # within the debounce window.
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.window_sec
+            while (remaining := deadline - loop.time()) > 0:
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+                except asyncio.TimeoutError:
+                    break
+
+            names = [name for name, _ in batch]
+            log_event("[ansible] Configuring batch of %s VMs: %s", len(names), names)
+            try:
+                failed = await self.vm_controller.configure_vm_with_ansible(names)
+            except Exception as e:  # noqa: BLE001
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+            else:
+                for name, future in batch:
+                    if future.done():
+                        continue
+                    if name in failed:
+                        future.set_exception(
+                            HTTPException(
+                                status_code=500,
+                                detail=f"Ansible configuration failed: {failed[name]}",
+                            )
+                        )
+                    else:
+                        future.set_result(None)
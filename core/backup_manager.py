@@ -1,12 +1,27 @@
+import asyncio
 import os
+import re
+import shlex
 import subprocess
-from config.settings import BACKUP_DIR
+import threading
+import uuid
+from typing import Optional
+
+import libvirt
+
+from config.settings import BACKUP_DIR, LIBVIRT_URI
 from core.logger import log_event
 
 
+# Interactive prompt(s) virsh prints to stdout in shell mode ("virsh # ", or
+# "virsh > " for read-only connections); they end up at the start of the next
+# output line, or at the end of output that lacks a final newline.
+_VIRSH_PROMPT = re.compile(rb"^(?:virsh [#>] )+|(?:virsh [#>] )+$")
+
+
 class BackupManager:
     """
-    Thin wrapper around virsh snapshots for libvirt-based hypervisors.
+    Thin wrapper around libvirt snapshots for libvirt-based hypervisors.
 
     For this thesis project we use simple disk-only snapshots without
     requiring the QEMU guest agent. This avoids errors like:
@@ -14,22 +29,149 @@ class BackupManager:
         "argument unsupported: QEMU guest agent is not configured"
 
     and still demonstrates integration with libvirt backup mechanisms.
+
+    When constructed with the controller's libvirt connection, snapshots are
+    created/listed directly through the libvirt API on that connection. Without
+    a connection (e.g. standalone use) it falls back to a shared `virsh` shell.
     """
 
-    def __init__(self) -> None:
+    _backup_dir_ready: bool = False
+
+    # Persistent `virsh` shell used by the fallback path, started on first use
+    _virsh_proc: Optional[subprocess.Popen] = None
+    _virsh_lock = threading.Lock()
+
+    # Equivalent of `virsh snapshot-create-as --disk-only --atomic --no-metadata`
+    _SNAPSHOT_FLAGS = (
+        libvirt.VIR_DOMAIN_SNAPSHOT_CREATE_DISK_ONLY
+        | libvirt.VIR_DOMAIN_SNAPSHOT_CREATE_ATOMIC
+        | libvirt.VIR_DOMAIN_SNAPSHOT_CREATE_NO_METADATA
+    )
+
+    def __init__(self, conn: Optional[libvirt.virConnect] = None) -> None:
+        self.conn = conn
         self.backup_dir = BACKUP_DIR
-        os.makedirs(self.backup_dir, exist_ok=True)
+        self._ensure_backup_dir()
+
+    @classmethod
+    def _ensure_backup_dir(cls) -> None:
+        # Only the first instance per process pays for the mkdir syscall.
+        if not cls._backup_dir_ready:
+            os.makedirs(BACKUP_DIR, exist_ok=True)
+            cls._backup_dir_ready = True
 
     def create_snapshot(self, vm_name: str, snapshot_name: str | None = None) -> str:
         if snapshot_name is None:
             snapshot_name = f"{vm_name}-snapshot"
 
-        # NOTE: we deliberately do NOT use '--quiesce' here because that
-        # requires the QEMU guest agent to be installed and configured
-        # inside the VM. For the purposes of this project, a simple disk-only
-        # snapshot is sufficient and avoids "argument unsupported" errors.
+        # NOTE: we deliberately do NOT quiesce here because that requires the
+        # QEMU guest agent to be installed and configured inside the VM. For
+        # the purposes of this project, a simple disk-only snapshot is
+        # sufficient and avoids "argument unsupported" errors.
+        if self.conn is None:
+            return self._create_snapshot_virsh(vm_name, snapshot_name)
+
+        log_event("[backup] Creating snapshot %s for VM %s via libvirt API", snapshot_name, vm_name)
+
+        snapshot_xml = f"<domainsnapshot><name>{snapshot_name}</name></domainsnapshot>"
+        try:
+            dom = self.conn.lookupByName(vm_name)
+            dom.snapshotCreateXML(snapshot_xml, self._SNAPSHOT_FLAGS)
+        except libvirt.libvirtError as e:
+            # Log the error but do NOT crash the main VM operation.
+            # Snapshots are a best-effort feature here.
+            log_event("[backup] WARNING: snapshot creation failed for %s: %s", vm_name, e)
+            # still return the requested snapshot name so callers can continue
+        return snapshot_name
+
+    async def bulk_snapshot(self, vm_names: list[str]) -> list[str | BaseException]:
+        """
+        Snapshot many VMs concurrently (e.g. a classroom-wide backup).
+
+        Each create_snapshot() blocks on libvirt/virsh I/O, so running them in
+        worker threads makes the total wall-clock time roughly that of the
+        slowest snapshot instead of the sum. Per-VM failures are returned in
+        place of the snapshot name rather than aborting the batch.
+        """
+        return await asyncio.gather(
+            *(asyncio.to_thread(self.create_snapshot, vm_name) for vm_name in vm_names),
+            return_exceptions=True,
+        )
+
+    def list_snapshots(self, vm_name: str) -> list[str]:
+        if self.conn is None:
+            return self._list_snapshots_virsh(vm_name)
+
+        log_event("[backup] Listing snapshots for VM %s via libvirt API", vm_name)
+
+        try:
+            dom = self.conn.lookupByName(vm_name)
+            snapshots = dom.snapshotListNames(0)
+            log_event("[backup] Found %s snapshots for VM %s", len(snapshots), vm_name)
+            return snapshots
+        except libvirt.libvirtError as e:
+            log_event("[backup] WARNING: failed to list snapshots for %s: %s", vm_name, e)
+            return []
+
+    # ------------------------------------------------------------------
+    # virsh fallback (no libvirt connection available)
+    # ------------------------------------------------------------------
+    @classmethod
+    def _run_virsh(cls, cmd: list[str]) -> bytes:
+        """
+        Run one command inside a shared, long-lived `virsh` shell.
+
+        The shell (and its libvirt connection) is started lazily on first use
+        and reused afterwards, so N snapshot operations cost one fork/exec
+        instead of N. Each command is followed by an `echo` of a unique marker
+        so we know where its output ends; the shell's prompts, which end up
+        in front of output lines, are stripped. Raises CalledProcessError if
+        virsh reports an error, mirroring `subprocess.run(..., check=True)`.
+
+        Output is returned as raw bytes; callers decode only what they keep.
+        """
+        with cls._virsh_lock:
+            proc = cls._virsh_proc
+            if proc is None or proc.poll() is not None:
+                proc = subprocess.Popen(
+                    ["virsh", "-c", LIBVIRT_URI, "--quiet"],
+                    stdin=subprocess.PIPE,
+                    stdout=subprocess.PIPE,
+                    stderr=subprocess.STDOUT,
+                    close_fds=False,
+                )
+                cls._virsh_proc = proc
+
+            marker = f"__vm_manager_done_{uuid.uuid4().hex}__\n".encode()
+            command = " ".join(shlex.quote(arg) for arg in cmd) + "\n"
+            proc.stdin.write(command.encode() + b"echo " + marker)
+            proc.stdin.flush()
+
+            lines: list[bytes] = []
+            for line in proc.stdout:
+                line = _VIRSH_PROMPT.sub(b"", line)
+                if line.endswith(marker):
+                    # Output of the command that lacked a final newline
+                    if rest := _VIRSH_PROMPT.sub(b"", line[: -len(marker)]):
+                        lines.append(rest)
+                    break
+                lines.append(line)
+            else:
+                # EOF before the marker: the shell died, respawn on next call
+                cls._virsh_proc = None
+                raise subprocess.CalledProcessError(
+                    proc.wait(), cmd, output=b"".join(lines), stderr="virsh shell exited"
+                )
+
+        output = b"".join(lines)
+        errors = [line for line in lines if line.startswith(b"error:")]
+        if errors:
+            stderr = b"".join(errors).decode(errors="replace")
+            raise subprocess.CalledProcessError(1, cmd, output=output, stderr=stderr)
+        return output
+
+    def _create_snapshot_virsh(self, vm_name: str, snapshot_name: str) -> str:
         cmd = [
-            "virsh",
             "snapshot-create-as",
             vm_name,
             snapshot_name,
@@ -38,40 +180,28 @@ class BackupManager:
             "--no-metadata",
         ]
 
-        log_event(f"[backup] Creating snapshot {snapshot_name} for VM {vm_name}: {' '.join(cmd)}")
+        log_event("[backup] Creating snapshot %s for VM %s: virsh %s", snapshot_name, vm_name, " ".join(cmd))
 
         try:
-            result = subprocess.run(
-                cmd,
-                capture_output=True,
-                text=True,
-                check=True,
-            )
-            if result.stdout:
-                log_event(f"[backup] virsh output for {vm_name}: {result.stdout.strip()}")
+            output = self._run_virsh(cmd).strip()
+            if output:
+                log_event("[backup] virsh output for %s: %s", vm_name, output.decode(errors="replace"))
         except subprocess.CalledProcessError as e:
-            # Log the error but do NOT crash the main VM operation.
-            # Snapshots are a best-effort feature here.
             err = e.stderr.strip() if e.stderr else str(e)
-            log_event(f"[backup] WARNING: snapshot creation failed for {vm_name}: {err}")
-            # still return the requested snapshot name so callers can continue
+            log_event("[backup] WARNING: snapshot creation failed for %s: %s", vm_name, err)
         return snapshot_name
 
-    def list_snapshots(self, vm_name: str) -> list[str]:
-        cmd = ["virsh", "snapshot-list", vm_name, "--name"]
-        log_event(f"[backup] Listing snapshots for VM {vm_name}: {' '.join(cmd)}")
+    def _list_snapshots_virsh(self, vm_name: str) -> list[str]:
+        cmd = ["snapshot-list", vm_name, "--name"]
+        log_event("[backup] Listing snapshots for VM %s: virsh %s", vm_name, " ".join(cmd))
 
         try:
-            result = subprocess.run(
-                cmd,
-                capture_output=True,
-                text=True,
-                check=True,
-            )
-            snapshots = [line.strip() for line in result.stdout.splitlines() if line.strip()]
-            log_event(f"[backup] Found {len(snapshots)} snapshots for VM {vm_name}")
+            output = self._run_virsh(cmd)
+            # Strip/filter on bytes and decode only the surviving names
+            snapshots = [name.decode() for line in output.split(b"\n") if (name := line.strip())]
+            log_event("[backup] Found %s snapshots for VM %s", len(snapshots), vm_name)
             return snapshots
         except subprocess.CalledProcessError as e:
             err = e.stderr.strip() if e.stderr else str(e)
-            log_event(f"[backup] WARNING: failed to list snapshots for {vm_name}: {err}")
+            log_event("[backup] WARNING: failed to list snapshots for %s: %s", vm_name, err)
             return []
@@ -0,0 +1,124 @@
+import asyncio
+import codecs
+import os
+import time
+from functools import lru_cache
+from typing import Optional
+
+import orjson
+
+from config.settings import SSH_LOG_DIR
+
+# Cast files are written through a large userspace buffer and flushed on a
+# timer, rather than issuing a small write per keystroke / output chunk.
+CAST_BUFFER_SIZE = 64 * 1024
+CAST_FLUSH_INTERVAL = 0.5
+
+# Records queued per session, and taken off the queue per write() call
+CAST_QUEUE_SIZE = 1024
+CAST_WRITE_BATCH = 256
+
+# Pre-serialized middle part of asciicast "i" (input) / "o" (output) records
+_CAST_INPUT = b', "i", '
+_CAST_OUTPUT = b', "o", '
+
+
+@lru_cache(maxsize=1)
+def _log_dir_fd() -> int:
+    # SSH_LOG_DIR opened once per process; recordings are created relative
+    # to it, so a new session doesn't re-resolve the directory path.
+    return os.open(SSH_LOG_DIR, os.O_RDONLY | os.O_DIRECTORY | os.O_CLOEXEC)
+
+
+def _cast_record(timestamp: float, event: bytes, data: str) -> bytes:
+    # [timestamp, "i"/"o", data] formatted directly; no list, no re-encoding
+    # of the constant event code.
+    return b"[%.6f%s%s]\n" % (timestamp, event, orjson.dumps(data))
+
+
+class CastRecorder:
+    """
+    Asciinema (v2 .cast) recording of one terminal session.
+
+    The SSH proxies only enqueue raw events; a writer task per session
+    formats them and writes whole batches with a single write() call, so
+    neither proxy loop does JSON encoding or file I/O on its hot path.
+    Must be created and used on the event loop thread.
+    """
+
+    def __init__(self, filename: str, header: dict) -> None:
+        """Start recording to SSH_LOG_DIR/`filename` (must not exist yet)."""
+        self.path = SSH_LOG_DIR / filename
+        fd = os.open(
+            filename,
+            os.O_WRONLY | os.O_CREAT | os.O_EXCL | os.O_CLOEXEC,
+            0o644,
+            dir_fd=_log_dir_fd(),
+        )
+        self._file = open(fd, "wb", buffering=CAST_BUFFER_SIZE)
+        self._file.write(orjson.dumps(header) + b"\n")
+        # asciicast v2 event times are seconds since the start of the
+        # recording (the header carries the wall-clock start); a monotonic
+        # clock keeps them correct across NTP adjustments.
+        self._started = time.perf_counter()
+        # Output is recorded as text; keep UTF-8 sequences split across
+        # reads intact
+        self._decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=CAST_QUEUE_SIZE)
+        self._writer: Optional[asyncio.Task] = asyncio.create_task(self._run())
+        self._flusher: Optional[asyncio.Task] = asyncio.create_task(self._flush_periodically())
+        self._closed = False
+
+    def record_input(self, message: str) -> None:
+        self._put((time.perf_counter() - self._started, _CAST_INPUT, message))
+
+    def record_output(self, data: bytes) -> None:
+        self._put((time.perf_counter() - self._started, _CAST_OUTPUT, data))
+
+    def _put(self, event: tuple) -> None:
+        if self._closed:
+            return
+        try:
+            self._queue.put_nowait(event)
+        except asyncio.QueueFull:
+            # Writer fell behind: catch up inline, keeping records in order
+            self._write_pending()
+            self._queue.put_nowait(event)
+
+    def _format(self, event: tuple) -> bytes:
+        timestamp, kind, data = event
+        if kind is _CAST_OUTPUT:
+            data = self._decoder.decode(data)
+        return _cast_record(timestamp, kind, data)
+
+    def _write_pending(self, first: Optional[tuple] = None) -> None:
+        batch = [] if first is None else [self._format(first)]
+        while len(batch) < CAST_WRITE_BATCH:
+            try:
+                batch.append(self._format(self._queue.get_nowait()))
+            except asyncio.QueueEmpty:
+                break
+        if batch:
+            self._file.write(b"".join(batch))
+
+    async def _run(self) -> None:
+        while True:
+            self._write_pending(await self._queue.get())
+
+    async def _flush_periodically(self) -> None:
+        while True:
+            await asyncio.sleep(CAST_FLUSH_INTERVAL)
+            self._file.flush()
+
+    def close(self) -> None:
+        """Write out everything still queued and close the file."""
+        if self._closed:
+            return
+        self._closed = True
+        for task in (self._writer, self._flusher):
+            if task is not None:
+                task.cancel()
+        self._writer = self._flusher = None
+        while not self._queue.empty():
+            self._write_pending()
+        self._file.close()
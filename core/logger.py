@@ -1,20 +1,41 @@
+import atexit
 import logging
 import os
+import queue
+from logging.handlers import QueueHandler, QueueListener
+
 from config.settings import LOG_FILE
 
 os.makedirs(os.path.dirname(LOG_FILE), exist_ok=True)
 
+# Callers only enqueue records; a single listener thread does the file I/O,
+# so log_event never blocks on the FileHandler lock or the write() syscall.
+_file_handler = logging.FileHandler(str(LOG_FILE))
+_file_handler.setFormatter(logging.Formatter("%(asctime)s [%(levelname)s] %(message)s"))
+
+_log_queue: queue.SimpleQueue = queue.SimpleQueue()
+_listener = QueueListener(_log_queue, _file_handler, respect_handler_level=True)
+_listener.start()
+atexit.register(_listener.stop)
+
+# The real format is applied by the file handler on the listener side.
+_queue_handler = QueueHandler(_log_queue)
+_queue_handler.setFormatter(logging.Formatter("%(message)s"))
+
 logging.basicConfig(
-    filename=str(LOG_FILE),
     level=logging.INFO,
-    format="%(asctime)s [%(levelname)s] %(message)s",
+    handlers=[_queue_handler],
 )
 
 logger = logging.getLogger("vm-manager")
 
 
-def log_event(message: str) -> None:
+def log_event(message: str, *args: object) -> None:
     """
     Write a single line event to the main vm-manager.log file.
+
+    `message` may contain %-style placeholders filled from `args`; formatting
+    is deferred to the logging framework and skipped when INFO is disabled.
     """
-    logger.info(message)
+    if logger.isEnabledFor(logging.INFO):
+        logger.info(message, *args)
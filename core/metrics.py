@@ -1,8 +1,8 @@
 import threading
 import time
+from functools import lru_cache
 from typing import Optional
 
-import psutil
 from prometheus_client import Counter, Gauge, Histogram
 
 from config.settings import (
@@ -11,6 +11,12 @@ from config.settings import (
 )
 from core.logger import log_event
 
+# Seconds between root filesystem usage samples in the collector loop
+DISK_USAGE_TTL = 60
+
+# Stop signal for the currently running host metrics collector thread
+_collector_stop: Optional[threading.Event] = None
+
 # -----------------------------
 # HTTP / API level metrics
 # -----------------------------
@@ -53,12 +59,21 @@ VM_LAST_ACTIVITY = Gauge(
     ["owner"],
 )
 
+VM_ANSIBLE_STATUS = Counter(
+    "vm_ansible_status_total",
+    "Background Ansible provisioning runs per VM, by outcome",
+    ["result"],
+)
+
 SSH_SESSIONS_ACTIVE = Gauge(
     "vm_ssh_sessions_active",
     "Number of active SSH WebSocket sessions",
     ["owner", "vm_name"],
 )
 
+# Authoritative session counts per (owner, vm_name); mirrored into the gauge
+_ssh_counts: dict[tuple[str, str], int] = {}
+
 # -----------------------------
 # Host / capacity metrics
 # -----------------------------
@@ -85,34 +100,73 @@ HYPERVISOR_INFO = Gauge(
 
 
 def init_static_metrics() -> None:
-    # Set a value 1.0 for the configured hypervisor type, 0.0 for others
-    for hv in ["qemu", "kvm", "hyperv", "vmware", "xen", "proxmox"]:
-        value = 1.0 if hv == HYPERVISOR_TYPE else 0.0
-        HYPERVISOR_INFO.labels(type=hv).set(value)
+    # Info-style gauge: only the configured hypervisor type is exported (=1.0)
+    HYPERVISOR_INFO.labels(type=HYPERVISOR_TYPE).set(1.0)
+
+
+# Labelled children never change for a given owner, so resolve each once.
+@lru_cache(maxsize=4096)
+def _created(owner_label: str):
+    return VM_CREATED_TOTAL.labels(owner=owner_label)
+
+
+@lru_cache(maxsize=4096)
+def _per_user(owner_label: str):
+    return VM_PER_USER.labels(owner=owner_label)
+
+
+@lru_cache(maxsize=4096)
+def _last_activity(owner_label: str):
+    return VM_LAST_ACTIVITY.labels(owner=owner_label)
+
+
+@lru_cache(maxsize=1024)
+def _request_count(method: str, endpoint: str):
+    return REQUEST_COUNT.labels(method=method, endpoint=endpoint)
+
+
+@lru_cache(maxsize=1024)
+def _request_latency(endpoint: str):
+    return REQUEST_LATENCY.labels(endpoint=endpoint)
+
+
+def record_request(method: str, endpoint: str, duration: float) -> None:
+    # `endpoint` must be a route template (e.g. /vms/start/{name}), not the
+    # raw path, to keep label cardinality bounded.
+    _request_count(method, endpoint).inc()
+    _request_latency(endpoint).observe(duration)
 
 
 def record_vm_created(owner: Optional[str]) -> None:
     owner_label = owner or "anonymous"
-    VM_CREATED_TOTAL.labels(owner=owner_label).inc()
-    VM_PER_USER.labels(owner=owner_label).inc()
-    VM_LAST_ACTIVITY.labels(owner=owner_label).set(time.time())
+    _created(owner_label).inc()
+    _per_user(owner_label).inc()
+    _last_activity(owner_label).set(time.time())
 
 
 def record_vm_deleted(owner: Optional[str]) -> None:
     owner_label = owner or "anonymous"
-    VM_PER_USER.labels(owner=owner_label).dec()
-    VM_LAST_ACTIVITY.labels(owner=owner_label).set(time.time())
+    _per_user(owner_label).dec()
+    _last_activity(owner_label).set(time.time())
 
 
 def record_vm_activity(owner: Optional[str]) -> None:
     owner_label = owner or "anonymous"
-    VM_LAST_ACTIVITY.labels(owner=owner_label).set(time.time())
+    _last_activity(owner_label).set(time.time())
+
+
+def record_ansible_result(result: str) -> None:
+    VM_ANSIBLE_STATUS.labels(result=result).inc()
 
 
 def record_ssh_session_change(owner: Optional[str], vm_name: str, delta: int) -> None:
     owner_label = owner or "anonymous"
-    current = SSH_SESSIONS_ACTIVE.labels(owner=owner_label, vm_name=vm_name)._value.get()
-    SSH_SESSIONS_ACTIVE.labels(owner=owner_label, vm_name=vm_name).set(max(current + delta, 0))
+    key = (owner_label, vm_name)
+    # Only called from the WebSocket handlers on the event loop thread, so
+    # this read-modify-write cannot interleave with another update.
+    count = max(_ssh_counts.get(key, 0) + delta, 0)
+    _ssh_counts[key] = count
+    SSH_SESSIONS_ACTIVE.labels(owner=owner_label, vm_name=vm_name).set(count)
 
 
 def start_background_collectors() -> None:
@@ -121,16 +175,49 @@ def start_background_collectors() -> None:
     This is enough for Grafana dashboards for CPU/memory/disk.
     """
 
+    global _collector_stop
+    # A collector from an earlier call would otherwise be orphaned (and keep
+    # writing the same gauges); stop it before replacing its event.
+    if _collector_stop is not None:
+        _collector_stop.set()
+    stop = threading.Event()
+    _collector_stop = stop
+
     def loop() -> None:
+        # Imported lazily: only the collector thread needs psutil.
+        import psutil
+
         log_event("[metrics] Starting background host metrics collector")
+        # The first sample is taken right away (so /metrics has values from
+        # startup), with CPU usage measured over a short blocking window;
+        # later calls are non-blocking and report usage since the previous
+        # call, i.e. over the last refresh interval.
+        cpu_interval: float | None = 0.1
+        # Root FS usage changes slowly, so it is only re-read every DISK_USAGE_TTL.
+        disk_checked_at = 0.0
         while True:
             try:
-                HOST_CPU_USAGE.set(psutil.cpu_percent(interval=1))
+                HOST_CPU_USAGE.set(psutil.cpu_percent(interval=cpu_interval))
+                cpu_interval = None
                 HOST_MEMORY_USAGE.set(psutil.virtual_memory().percent)
-                HOST_DISK_USAGE.set(psutil.disk_usage("/").percent)
+                now = time.monotonic()
+                if now - disk_checked_at >= DISK_USAGE_TTL:
+                    HOST_DISK_USAGE.set(psutil.disk_usage("/").percent)
+                    disk_checked_at = now
             except Exception as e:  # noqa: BLE001
-                log_event(f"[metrics] Collector error: {e}")
-            time.sleep(METRICS_REFRESH_INTERVAL)
+                log_event("[metrics] Collector error: %s", e)
+            if stop.wait(METRICS_REFRESH_INTERVAL):
+                break
+        log_event("[metrics] Background host metrics collector stopped")
 
     t = threading.Thread(target=loop, daemon=True)
     t.start()
+
+
+def stop_background_collectors() -> None:
+    """
+    Signal the host metrics collector started by start_background_collectors()
+    to exit; the thread wakes up immediately instead of finishing its sleep.
+    """
+    if _collector_stop is not None:
+        _collector_stop.set()
@@ -1,9 +1,22 @@
 import os
-import libvirt
 
 from config.settings import HOT_VM_POOL_SIZE, DEFAULT_MEMORY_MB, DEFAULT_VCPU, VM_STORAGE_PATH
 from core.logger import log_event
 
+_STORAGE_STR = os.fspath(VM_STORAGE_PATH)
+
+# Basic mapping of libvirt state codes, indexed by code (0..7)
+_STATE_MAP = (
+    "no state",
+    "running",
+    "blocked",
+    "paused",
+    "shutting down",
+    "shut off",
+    "crashed",
+    "pmsuspended",
+)
+
 
 class PoolManager:
     """
@@ -38,41 +51,45 @@ class PoolManager:
             - Create a fresh VM via VMController.
             - Shut it down so it's ready in the pool.
         """
+        # libvirt is imported lazily so importing this module stays cheap
+        import libvirt
+
         conn = self.vm_controller.conn
-        disk_path = VM_STORAGE_PATH / f"{name}.qcow2"
+        disk_path = os.path.join(_STORAGE_STR, name + ".qcow2")
 
         try:
             dom = conn.lookupByName(name)
             info = dom.info()
             state = info[0]
-            # libvirt states: 1=running, 5=shutoff
-            if state == 1:
-                log_event(f"[pool] Pool VM {name} is running, stopping it")
+            # Only a running VM needs a shutdown RPC; shut off, shutting down
+            # or paused domains are left alone.
+            if state == libvirt.VIR_DOMAIN_RUNNING:
+                log_event("[pool] Pool VM %s is running, stopping it", name)
                 try:
                     dom.shutdown()
                 except libvirt.libvirtError:
                     # force destroy if graceful shutdown fails
                     dom.destroy()
-                log_event(f"[pool] Pool VM {name} is now stopping (will transition to shut off)")
+                log_event("[pool] Pool VM %s is now stopping (will transition to shut off)", name)
             else:
-                log_event(f"[pool] Pool VM {name} already exists with state={state}")
+                log_event("[pool] Pool VM %s already exists with state=%s", name, state)
         except libvirt.libvirtError:
             # Domain missing in libvirt
-            if disk_path.exists():
-                log_event(f"[pool] Orphan disk {disk_path} found for {name}, removing it")
+            if os.path.exists(disk_path):
+                log_event("[pool] Orphan disk %s found for %s, removing it", disk_path, name)
                 try:
                     os.remove(disk_path)
                 except OSError as e:
-                    log_event(f"[pool] Failed to remove orphan disk {disk_path}: {e}")
+                    log_event("[pool] Failed to remove orphan disk %s: %s", disk_path, e)
 
-            log_event(f"[pool] Creating new pool VM {name}")
+            log_event("[pool] Creating new pool VM %s", name)
             vm_info = self.vm_controller.create_vm(
                 name=name,
                 memory_mb=DEFAULT_MEMORY_MB,
                 vcpus=DEFAULT_VCPU,
                 owner="pool",
             )
-            log_event(f"[pool] Created pool VM {name}: {vm_info}")
+            log_event("[pool] Created pool VM %s: %s", name, vm_info)
             # Ensure it's stopped after creation, so it's ready
             self.vm_controller.stop_vm(name)
 
@@ -93,42 +110,34 @@ class PoolManager:
                 self._ensure_pool_vm_exists_and_stopped(name)
                 self.pool.append(name)
             except Exception as e:  # noqa: BLE001
-                log_event(f"[pool] ERROR initializing pool VM {name}: {e}")
+                log_event("[pool] ERROR initializing pool VM %s: %s", name, e)
 
-        log_event(f"[pool] Pool initialized with VMs: {self.pool}")
+        log_event("[pool] Pool initialized with VMs: %s", self.pool)
 
     def get_pool_status(self) -> list[dict]:
         """
         Return the status of each pool VM (name + libvirt state).
+
+        All domains are fetched with a single listAllDomains() call and
+        matched client-side, instead of one lookupByName() per pool VM.
         """
+        import libvirt
+
         status: list[dict] = []
         conn = self.vm_controller.conn
+        domains = {dom.name(): dom for dom in conn.listAllDomains(0)}
 
         for name in self.pool:
-            try:
-                dom = conn.lookupByName(name)
-                info = dom.info()
-                state_code = info[0]
-                # Basic mapping of state codes
-                state_map = {
-                    0: "no state",
-                    1: "running",
-                    2: "blocked",
-                    3: "paused",
-                    4: "shutting down",
-                    5: "shut off",
-                    6: "crashed",
-                    7: "pmsuspended",
-                }
-                state_str = state_map.get(state_code, f"unknown({state_code})")
-                status.append(
-                    {
-                        "name": name,
-                        "state_code": state_code,
-                        "state": state_str,
-                    }
-                )
-            except libvirt.libvirtError:
+            dom = domains.get(name)
+            state_code = None
+            if dom is not None:
+                try:
+                    state_code = dom.info()[0]
+                except libvirt.libvirtError:
+                    # Domain vanished between listing and inspection
+                    pass
+
+            if state_code is None:
                 status.append(
                     {
                         "name": name,
@@ -136,6 +145,19 @@ class PoolManager:
                         "state": "not_found",
                     }
                 )
+                continue
+
+            if 0 <= state_code < len(_STATE_MAP):
+                state_str = _STATE_MAP[state_code]
+            else:
+                state_str = f"unknown({state_code})"
+            status.append(
+                {
+                    "name": name,
+                    "state_code": state_code,
+                    "state": state_str,
+                }
+            )
 
         return status
 
@@ -150,6 +172,8 @@ class PoolManager:
             - If domain exists, ensure it's shut off, then return it.
         - Only return None if everything truly fails.
         """
+        import libvirt
+
         conn = self.vm_controller.conn
 
         for name in self.pool:
@@ -157,12 +181,12 @@ class PoolManager:
                 dom = conn.lookupByName(name)
             except libvirt.libvirtError:
                 # VM missing - recreate it and then return it
-                log_event(f"[pool] Pool VM {name} missing in libvirt, recreating")
+                log_event("[pool] Pool VM %s missing in libvirt, recreating", name)
                 try:
                     self._ensure_pool_vm_exists_and_stopped(name)
                     return name
                 except Exception as e:  # noqa: BLE001
-                    log_event(f"[pool] ERROR recreating pool VM {name}: {e}")
+                    log_event("[pool] ERROR recreating pool VM %s: %s", name, e)
                     continue
 
             try:
@@ -170,18 +194,20 @@ class PoolManager:
                 state = info[0]
 
                 # If it's running, we still consider it "usable", but for the
-                # thesis idea we prefer to hand out shut off VMs.
-                if state != 5:
-                    log_event(f"[pool] Pool VM {name} is in state={state}, attempting to shut it off")
+                # thesis idea we prefer to hand out shut off VMs. Only a
+                # running VM needs a shutdown RPC; other states are either
+                # already off or already transitioning.
+                if state == libvirt.VIR_DOMAIN_RUNNING:
+                    log_event("[pool] Pool VM %s is in state=%s, attempting to shut it off", name, state)
                     try:
                         dom.shutdown()
                     except libvirt.libvirtError:
                         dom.destroy()
 
-                log_event(f"[pool] Returning pool VM {name} as available")
+                log_event("[pool] Returning pool VM %s as available", name)
                 return name
             except libvirt.libvirtError as e:
-                log_event(f"[pool] ERROR checking state for {name}: {e}")
+                log_event("[pool] ERROR checking state for %s: %s", name, e)
                 continue
 
         return None
@@ -0,0 +1,116 @@
+import asyncio
+import socket
+from typing import Dict, Tuple
+
+import asyncssh
+
+from config.settings import SSH_POOL_IDLE_TIMEOUT
+from core.logger import log_event
+
+_Key = Tuple[str, int, str]
+
+
+def _set_nodelay(sock) -> None:
+    # Disable Nagle so single keystrokes / echoes aren't held back waiting
+    # for an ACK. Non-TCP transports (e.g. unix sockets) don't support it.
+    if sock is None:
+        return
+    try:
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    except OSError:
+        pass
+
+
+class SSHConnectionPool:
+    """
+    Shares one asyncssh connection per (host, port, username) between
+    terminal sessions.
+
+    SSH multiplexes sessions as channels over a single connection, so a
+    second terminal to the same VM only opens a channel instead of paying
+    for a new TCP handshake, key exchange and authentication (and counting
+    against sshd's MaxStartups). Connections are reference counted and
+    closed SSH_POOL_IDLE_TIMEOUT seconds after their last session ends.
+    """
+
+    def __init__(self, idle_timeout: float = SSH_POOL_IDLE_TIMEOUT) -> None:
+        self.idle_timeout = idle_timeout
+        self._conns: Dict[_Key, asyncssh.SSHClientConnection] = {}
+        self._refs: Dict[_Key, int] = {}
+        self._close_timers: Dict[_Key, asyncio.TimerHandle] = {}
+        self._locks: Dict[_Key, asyncio.Lock] = {}
+        self._watchers: set[asyncio.Task] = set()
+
+    @staticmethod
+    def _key(target: dict) -> _Key:
+        return (target["host"], target["port"], target["username"])
+
+    async def acquire(self, target: dict) -> asyncssh.SSHClientConnection:
+        """
+        Return a connection for `target` (as built by
+        VMController.get_vm_ssh_target()), opening one if needed. Every
+        acquire() must be paired with a release() of the same target.
+        """
+        key = self._key(target)
+        # Serializes connects per target so concurrent sessions share one
+        async with self._locks.setdefault(key, asyncio.Lock()):
+            conn = self._conns.get(key)
+            if conn is None:
+                key_path = target.get("key_path")
+                conn = await asyncssh.connect(
+                    host=target["host"],
+                    port=target["port"],
+                    username=target["username"],
+                    client_keys=[key_path] if key_path else None,
+                    known_hosts=None,
+                )
+                _set_nodelay(conn.get_extra_info("socket"))
+                self._conns[key] = conn
+                watcher = asyncio.create_task(self._forget_when_closed(key, conn))
+                self._watchers.add(watcher)
+                watcher.add_done_callback(self._watchers.discard)
+                log_event("[ssh-pool] Opened connection to %s@%s:%s", key[2], key[0], key[1])
+
+            timer = self._close_timers.pop(key, None)
+            if timer is not None:
+                timer.cancel()
+            self._refs[key] = self._refs.get(key, 0) + 1
+            return conn
+
+    def release(self, target: dict) -> None:
+        key = self._key(target)
+        refs = self._refs.get(key, 0) - 1
+        if refs > 0:
+            self._refs[key] = refs
+            return
+        self._refs.pop(key, None)
+        if key in self._conns:
+            loop = asyncio.get_running_loop()
+            self._close_timers[key] = loop.call_later(self.idle_timeout, self._close_idle, key)
+
+    def _close_idle(self, key: _Key) -> None:
+        self._close_timers.pop(key, None)
+        if self._refs.get(key):
+            return
+        conn = self._conns.pop(key, None)
+        if conn is not None:
+            log_event("[ssh-pool] Closing idle connection to %s@%s:%s", key[2], key[0], key[1])
+            conn.close()
+
+    async def _forget_when_closed(self, key: _Key, conn: asyncssh.SSHClientConnection) -> None:
+        # Drop connections the server (or network) closed, so the next
+        # acquire() reconnects instead of handing out a dead connection.
+        await conn.wait_closed()
+        if self._conns.get(key) is conn:
+            del self._conns[key]
+            log_event("[ssh-pool] Connection to %s@%s:%s closed", key[2], key[0], key[1])
+
+    async def close_all(self) -> None:
+        for timer in self._close_timers.values():
+            timer.cancel()
+        self._close_timers.clear()
+        conns, self._conns = list(self._conns.values()), {}
+        for conn in conns:
+            conn.close()
+        for conn in conns:
+            await conn.wait_closed()
@@ -1,9 +1,24 @@
+import asyncio
+import errno
+import fcntl
+import json
 import os
+import queue
+import re
 import shutil
+import string
+import struct
 import subprocess
+import threading
 import time
 import uuid
-from typing import Any, Dict, List, Optional
+from collections import deque
+from contextlib import contextmanager
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Optional
+from xml.etree import ElementTree
+from xml.sax.saxutils import escape, quoteattr
 
 import libvirt
 from fastapi import HTTPException
@@ -15,8 +30,13 @@ from config.settings import (
     DEFAULT_VCPU,
     ANSIBLE_HOSTS_FILE,
     ANSIBLE_PLAYBOOK,
+    ANSIBLE_FORKS,
+    ANSIBLE_TIMEOUT,
     LIBVIRT_URI,
+    LIBVIRT_POOL_SIZE,
     HYPERVISOR_TYPE,
+    USE_IO_URING,
+    USE_BACKING_FILE,
     VM_SSH_HOST_TEMPLATE,
     VM_SSH_PORT,
     VM_SSH_USERNAME,
@@ -36,6 +56,116 @@ def _libvirt_error_handler(ctx, error):
     pass
 
 
+# VM names end up in file paths, libvirt XML and Ansible host lists
+_VALID_VM_NAME = re.compile(r"[a-zA-Z0-9_-]{1,64}")
+
+# ansible-playbook output: per-host PLAY RECAP lines and task failure lines
+_ANSIBLE_RECAP = re.compile(r"^(\S+)\s+:\s+ok=\d+\s+changed=\d+\s+unreachable=(\d+)\s+failed=(\d+)")
+_ANSIBLE_FAILURE = re.compile(r"^(?:fatal|failed): \[([^\]\s]+)")
+
+# ansible-playbook output is read in chunks of this size; lines longer than
+# _ANSIBLE_MAX_LINE (e.g. huge task results) are cut off there.
+_ANSIBLE_READ_SIZE = 64 * 1024
+_ANSIBLE_MAX_LINE = 1 << 20
+
+# errno values meaning "this copy syscall cannot handle these two files"
+_COPY_FALLBACK_ERRNOS = frozenset({errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP})
+
+
+def _fast_copy(src: str, dst: str) -> None:
+    """
+    Copy src over dst (created if missing) inside the kernel.
+
+    copy_file_range(2) lets XFS/Btrfs reflink the data (metadata-only copy)
+    and avoids userspace buffers elsewhere; if the kernel/filesystem pair
+    does not support it we continue with sendfile(2), and only if that is
+    unavailable too fall back to shutil.copy2.
+    """
+    try:
+        with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+            src_fd, dst_fd = fsrc.fileno(), fdst.fileno()
+            offset = 0
+            try:
+                while n := os.copy_file_range(src_fd, dst_fd, 1 << 30):
+                    offset += n
+                return
+            except (AttributeError, OSError) as e:
+                if isinstance(e, OSError) and e.errno not in _COPY_FALLBACK_ERRNOS:
+                    raise
+            # Both fds are positioned at `offset`, so sendfile resumes there
+            while n := os.sendfile(dst_fd, src_fd, offset, 1 << 30):
+                offset += n
+            return
+    except OSError as e:
+        if e.errno not in _COPY_FALLBACK_ERRNOS:
+            raise
+    shutil.copy2(src, dst)
+
+
+# linux/fs.h: chattr +C is FS_NOCOW_FL set via FS_IOC_SETFLAGS
+FS_IOC_GETFLAGS = 0x80086601
+FS_IOC_SETFLAGS = 0x40086602
+FS_NOCOW_FL = 0x00800000
+
+
+@lru_cache(maxsize=32)
+def _is_btrfs(directory: str) -> bool:
+    """Return True if directory lives on btrfs (longest /proc/mounts prefix wins)."""
+    directory = os.path.realpath(directory)
+    best, fstype = "", ""
+    try:
+        with open("/proc/mounts", encoding="utf-8") as mounts:
+            for line in mounts:
+                fields = line.split()
+                if len(fields) < 3:
+                    continue
+                mount_point = fields[1].replace("\\040", " ")
+                prefix = mount_point.rstrip("/") + "/"
+                if (directory == mount_point or directory.startswith(prefix)) and len(mount_point) > len(best):
+                    best, fstype = mount_point, fields[2]
+    except OSError:
+        return False
+    return fstype == "btrfs"
+
+
+def _disable_cow(path: str) -> None:
+    """
+    `chattr +C` equivalent. qcow2 on a copy-on-write filesystem means two
+    layers of COW; the flag only takes effect while the file is still empty,
+    so this must run before any image data is written.
+    """
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        (flags,) = struct.unpack("I", fcntl.ioctl(fd, FS_IOC_GETFLAGS, struct.pack("I", 0)))
+        fcntl.ioctl(fd, FS_IOC_SETFLAGS, struct.pack("I", flags | FS_NOCOW_FL))
+    finally:
+        os.close(fd)
+
+
+_event_loop_lock = threading.Lock()
+_event_loop_started = False
+
+
+def _start_libvirt_event_loop() -> None:
+    """
+    Register libvirt's default event implementation and run it on a daemon
+    thread. This has to happen before a connection is opened for domain
+    lifecycle events to be delivered on that connection.
+    """
+    global _event_loop_started
+    with _event_loop_lock:
+        if _event_loop_started:
+            return
+        libvirt.virEventRegisterDefaultImpl()
+
+        def run() -> None:
+            while True:
+                libvirt.virEventRunDefaultImpl()
+
+        threading.Thread(target=run, name="libvirt-events", daemon=True).start()
+        _event_loop_started = True
+
+
 class VMController:
     """
     Core VM lifecycle operations, abstracted over libvirt.
@@ -53,6 +183,7 @@ class VMController:
     def __init__(self) -> None:
         # Register global libvirt error handler to avoid noisy stderr prints
         libvirt.registerErrorHandler(_libvirt_error_handler, None)
+        _start_libvirt_event_loop()
 
         try:
             uri = LIBVIRT_URI
@@ -62,26 +193,254 @@ class VMController:
                     status_code=500,
                     detail=f"Failed to connect to hypervisor via libvirt URI: {uri}",
                 )
-            log_event(f"[vm] Connected to hypervisor via libvirt URI={uri}, type={HYPERVISOR_TYPE}")
+            log_event("[vm] Connected to hypervisor via libvirt URI=%s, type=%s", uri, HYPERVISOR_TYPE)
         except libvirt.libvirtError as e:
             raise HTTPException(status_code=500, detail=f"libvirt connection error: {e}") from e
 
-        self.backup_manager = BackupManager()
+        # Extra connections handed out to request threads, so concurrent API
+        # calls don't all serialize their RPCs on the single primary
+        # connection (which keeps serving events, the cache and backups).
+        self._conn_pool: "queue.Queue[libvirt.virConnect]" = queue.Queue(maxsize=LIBVIRT_POOL_SIZE)
+        try:
+            for _ in range(LIBVIRT_POOL_SIZE):
+                self._conn_pool.put(libvirt.open(LIBVIRT_URI))
+        except libvirt.libvirtError as e:
+            raise HTTPException(status_code=500, detail=f"libvirt connection error: {e}") from e
+        log_event("[vm] Opened libvirt connection pool of size %s", LIBVIRT_POOL_SIZE)
+
+        self.backup_manager = BackupManager(self.conn)
+
+        # Running ansible-playbook processes, so they can be cancelled. Only
+        # touched from the event loop thread, hence no lock.
+        self._ansible_procs: set[asyncio.subprocess.Process] = set()
+
+        # In-memory view of all domains (name -> _domain_info() entry), kept
+        # up to date by libvirt lifecycle events, so existence and state
+        # checks don't query libvirt per request.
+        self._vm_cache: Dict[str, Dict[str, Any]] = {}
+        # Resolved domain handles for the same names, per pooled connection
+        # (name -> {conn: handle}), so operations can skip lookupByName()
+        # while still issuing their RPCs on the connection they borrowed.
+        self._dom_cache: Dict[str, Dict[libvirt.virConnect, libvirt.virDomain]] = {}
+        self._cache_lock = threading.Lock()
+
+        # subscribe_state_changes() callbacks, called with a VM name
+        self._state_listeners: List[Callable[[str], None]] = []
+
+        # create_vm(on_guest_ready=...) callbacks waiting for the guest agent
+        # of a new VM to come online (name -> callback).
+        self._guest_ready_callbacks: Dict[str, Callable[[str], None]] = {}
+
+        # Everything the event callbacks touch must exist before this
+        # registers them; events can arrive right away.
+        self._events_enabled = self._init_vm_cache()
+        self.guest_ready_events = self._events_enabled and self._init_agent_events()
+
+    @contextmanager
+    def _conn(self) -> Iterator[libvirt.virConnect]:
+        """
+        Borrow a libvirt connection from the pool for the duration of an
+        operation (blocks if all connections are in use).
+        """
+        conn = self._conn_pool.get()
+        try:
+            yield conn
+        finally:
+            self._conn_pool.put(conn)
 
     # ------------------------------------------------------------------
-    # Utility methods
+    # Domain cache (libvirt lifecycle events)
     # ------------------------------------------------------------------
-    def vm_exists(self, name: str) -> bool:
+    def _init_vm_cache(self) -> bool:
+        """
+        Subscribe to lifecycle events and populate the domain cache.
+
+        Returns False if the hypervisor driver does not support domain
+        events; the controller then keeps querying libvirt directly.
+        """
         try:
-            self.conn.lookupByName(name)
-            return True
-        except libvirt.libvirtError:
+            # Register first so no event is lost between listing and subscribing
+            self.conn.domainEventRegisterAny(
+                None,
+                libvirt.VIR_DOMAIN_EVENT_ID_LIFECYCLE,
+                self._on_lifecycle_event,
+                None,
+            )
+        except libvirt.libvirtError as e:
+            log_event("[vm] Lifecycle events unavailable (%s); VM lookups will query libvirt directly", e)
+            return False
+
+        with self._cache_lock:
+            for _, entry in self._all_domain_info(self.conn):
+                self._vm_cache[entry["name"]] = entry
+        log_event("[vm] Domain cache initialized with %s VMs", len(self._vm_cache))
+        return True
+
+    def _init_agent_events(self) -> bool:
+        """
+        Subscribe to guest agent (qemu-ga) connect/disconnect events, used to
+        tell when a freshly booted guest is ready for provisioning.
+        """
+        try:
+            self.conn.domainEventRegisterAny(
+                None,
+                libvirt.VIR_DOMAIN_EVENT_ID_AGENT_LIFECYCLE,
+                self._on_agent_lifecycle_event,
+                None,
+            )
+        except libvirt.libvirtError as e:
+            log_event("[vm] Guest agent events unavailable (%s); VMs are provisioned right after creation", e)
+            return False
+        return True
+
+    @staticmethod
+    def _domain_info(dom) -> Dict[str, Any]:
+        info = dom.info()
+        return {
+            "name": dom.name(),
+            "id": dom.ID(),
+            "state": info[0],
+            "max_memory": info[1],
+            "memory": info[2],
+            "vcpus": info[3],
+            "cpu_time": info[4],
+        }
+
+    # State, balloon, vcpu and CPU time: everything dom.info() reports
+    _DOMAIN_STATS = (
+        libvirt.VIR_DOMAIN_STATS_STATE
+        | libvirt.VIR_DOMAIN_STATS_BALLOON
+        | libvirt.VIR_DOMAIN_STATS_VCPU
+        | libvirt.VIR_DOMAIN_STATS_CPU_TOTAL
+    )
+
+    def _all_domain_info(self, conn) -> List[tuple]:
+        """
+        (dom, _domain_info(dom)) for every domain, fetched with a single
+        getAllDomainStats() RPC instead of one dom.info() per domain.
+        Drivers without bulk stats support fall back to the per-domain loop.
+        """
+        try:
+            records = conn.getAllDomainStats(self._DOMAIN_STATS)
+        except libvirt.libvirtError as e:
+            if e.get_error_code() != libvirt.VIR_ERR_NO_SUPPORT:
+                raise
+            vms: List[tuple] = []
+            for dom in conn.listAllDomains():
+                try:
+                    vms.append((dom, self._domain_info(dom)))
+                except libvirt.libvirtError:
+                    continue
+            return vms
+
+        # name() and ID() are answered from the handle, without an RPC
+        return [
+            (
+                dom,
+                {
+                    "name": dom.name(),
+                    "id": dom.ID(),
+                    "state": params.get("state.state", libvirt.VIR_DOMAIN_NOSTATE),
+                    "max_memory": params.get("balloon.maximum", 0),
+                    "memory": params.get("balloon.current", 0),
+                    "vcpus": params.get("vcpu.current", 0),
+                    "cpu_time": params.get("cpu.time", 0),
+                },
+            )
+            for dom, params in records
+        ]
+
+    def _cache_domain(self, dom) -> None:
+        entry = self._domain_info(dom)
+        with self._cache_lock:
+            self._vm_cache[entry["name"]] = entry
+
+    def _evict_domain(self, name: str) -> None:
+        with self._cache_lock:
+            self._vm_cache.pop(name, None)
+            self._dom_cache.pop(name, None)
+            self._guest_ready_callbacks.pop(name, None)
+
+    def _on_lifecycle_event(self, conn, dom, event, detail, opaque) -> None:
+        # Runs on the libvirt event loop thread, once per actual state change.
+        name = dom.name()
+        if event == libvirt.VIR_DOMAIN_EVENT_UNDEFINED:
+            self._evict_domain(name)
+        else:
+            try:
+                self._cache_domain(dom)
+            except libvirt.libvirtError:
+                # Domain disappeared before we could inspect it
+                self._evict_domain(name)
+
+        for listener in self._state_listeners:
+            try:
+                listener(name)
+            except Exception as e:  # noqa: BLE001
+                log_event("[vm] State listener failed for VM '%s': %s", name, e)
+
+    def subscribe_state_changes(self, callback: Callable[[str], None]) -> bool:
+        """
+        Call `callback(vm_name)` on every lifecycle event (start, stop,
+        undefine, ...) of any VM. It runs on the libvirt event thread, so it
+        must be quick and thread-safe. Returns False, without subscribing,
+        if this hypervisor connection does not deliver lifecycle events.
+        """
+        if not self._events_enabled:
             return False
+        self._state_listeners.append(callback)
+        return True
+
+    def _on_agent_lifecycle_event(self, conn, dom, state, reason, opaque) -> None:
+        # Runs on the libvirt event loop thread; fires each time qemu-ga in a
+        # guest (re)connects, but only the first one after create_vm matters.
+        if state != libvirt.VIR_CONNECT_DOMAIN_EVENT_AGENT_LIFECYCLE_STATE_CONNECTED:
+            return
+        name = dom.name()
+        with self._cache_lock:
+            callback = self._guest_ready_callbacks.pop(name, None)
+        if callback is None:
+            return
+        log_event("[vm] Guest agent of VM '%s' is online", name)
+        try:
+            callback(name)
+        except Exception as e:  # noqa: BLE001
+            log_event("[vm] Guest-ready callback failed for VM '%s': %s", name, e)
+
+    def cancel_guest_ready(self, name: str) -> bool:
+        """
+        Drop the create_vm(on_guest_ready=...) callback of `name` if it has
+        not fired yet. Returns True if it was still pending, i.e. it is now
+        guaranteed never to be called.
+        """
+        with self._cache_lock:
+            return self._guest_ready_callbacks.pop(name, None) is not None
+
+    # ------------------------------------------------------------------
+    # Utility methods
+    # ------------------------------------------------------------------
+    def vm_exists(self, name: str) -> bool:
+        if self._events_enabled:
+            with self._cache_lock:
+                return name in self._vm_cache
+        with self._conn() as conn:
+            try:
+                conn.lookupByName(name)
+                return True
+            except libvirt.libvirtError:
+                return False
 
     def _clone_base_image(self, name: str) -> str:
         """
-        Create a QCOW2 image for a VM by copying base.qcow2 inside the
-        project `vm-images/` directory.
+        Create a QCOW2 image for a VM as a linked clone of base.qcow2 inside
+        the project `vm-images/` directory.
+
+        The new image only stores a qcow2 header with base.qcow2 as its
+        backing file; unmodified clusters are read from the (shared, usually
+        page-cached) base image, so no base data is copied per VM.
+
+        With USE_BACKING_FILE=false the VM gets a fully independent copy of
+        base.qcow2 instead, made via _fast_copy().
         """
         if not BASE_IMAGE_PATH.exists():
             raise HTTPException(
@@ -96,43 +455,84 @@ class VMController:
                 detail=f"VM image already exists for {name} at {vm_image_path}",
             )
 
+        self._write_image(name, vm_image_path)
+        return str(vm_image_path)
+
+    def _write_image(self, name: str, image_path: Path) -> None:
+        """
+        Create `image_path` as a fresh disk for VM `name`: a qcow2 overlay on
+        base.qcow2, or a full copy of it when USE_BACKING_FILE is off.
+        Removes the partial file and raises HTTPException(500) on failure.
+        """
+        # Create the file empty first so btrfs COW can be switched off before
+        # qemu-img / _fast_copy write any data into it.
+        image_path.touch(exist_ok=False)
+        if _is_btrfs(str(VM_STORAGE_PATH)):
+            try:
+                _disable_cow(str(image_path))
+            except OSError as e:
+                log_event("[vm] WARNING: could not disable COW on %s: %s", image_path, e)
+
+        if not USE_BACKING_FILE:
+            try:
+                log_event("[vm] Copying %s to %s", BASE_IMAGE_PATH, image_path)
+                _fast_copy(str(BASE_IMAGE_PATH), str(image_path))
+            except OSError as e:
+                log_event("[vm] Failed to copy base image for VM %s: %s", name, e)
+                image_path.unlink(missing_ok=True)
+                raise HTTPException(
+                    status_code=500,
+                    detail=f"Failed to copy base image for VM '{name}': {e}",
+                )
+            return
+
+        cmd = [
+            "qemu-img",
+            "create",
+            "-f",
+            "qcow2",
+            "-F",
+            "qcow2",
+            "-b",
+            str(BASE_IMAGE_PATH),
+            "-o",
+            "cluster_size=128k,extended_l2=on",
+            str(image_path),
+        ]
+
         try:
-            log_event(f"[vm] Copying base image from {BASE_IMAGE_PATH} to {vm_image_path}")
-            shutil.copy2(BASE_IMAGE_PATH, vm_image_path)
-        except Exception as e:  # noqa: BLE001
-            log_event(f"[vm] Failed to copy base image for VM {name}: {e}")
+            log_event("[vm] Creating linked clone of %s at %s", BASE_IMAGE_PATH, image_path)
+            # Our fds are non-inheritable (PEP 446), so skipping the close-all
+            # pass over the fd table is safe and lets Python use vfork.
+            subprocess.run(cmd, check=True, capture_output=True, close_fds=False)
+        except (OSError, subprocess.CalledProcessError) as e:
+            err = e.stderr.decode(errors="replace").strip() if getattr(e, "stderr", None) else str(e)
+            log_event("[vm] Failed to clone base image for VM %s: %s", name, err)
+            image_path.unlink(missing_ok=True)
             raise HTTPException(
                 status_code=500,
-                detail=f"Failed to copy base image for VM '{name}': {e}",
+                detail=f"Failed to clone base image for VM '{name}': {err}",
             )
 
-        return str(vm_image_path)
-
-    @staticmethod
-    def _generate_domain_xml(
-        name: str,
-        vm_uuid: str,
-        vm_image: str,
-        memory_mb: int,
-        vcpus: int,
-    ) -> str:
-        """
-        Minimal domain XML definition suitable for QEMU/KVM style hypervisors.
-        """
-        return f"""
+    # Domain XML, compiled once at class load; per-VM fields are substituted
+    # in _generate_domain_xml().
+    _XML_TEMPLATE = string.Template(
+        f"""
         <domain type='kvm'>
-          <name>{name}</name>
-          <uuid>{vm_uuid}</uuid>
-          <memory unit='MiB'>{memory_mb}</memory>
-          <vcpu>{vcpus}</vcpu>
+          <name>$name</name>
+          <uuid>$uuid</uuid>
+          <memory unit='MiB'>$memory_mb</memory>
+          <vcpu>$vcpus</vcpu>
+          <iothreads>1</iothreads>
+          <cpu mode='host-passthrough'/>
           <os>
             <type arch='x86_64'>hvm</type>
             <boot dev='hd'/>
           </os>
           <devices>
             <disk type='file' device='disk'>
-              <driver name='qemu' type='qcow2'/>
-              <source file='{vm_image}'/>
+              <driver name='qemu' type='qcow2' cache='none'{" io='io_uring'" if USE_IO_URING else ""} discard='unmap' iothread='1' queues='$vcpus'/>
+              <source file=$vm_image/>
               <target dev='vda' bus='virtio'/>
             </disk>
             <interface type='network'>
@@ -140,17 +540,69 @@ class VMController:
               <model type='virtio'/>
             </interface>
             <graphics type='vnc' port='-1' autoport='yes'/>
+            <controller type='virtio-serial'/>
+            <channel type='unix'>
+              <target type='virtio' name='org.qemu.guest_agent.0'/>
+            </channel>
             <console type='pty'/>
+            <memballoon model='virtio'/>
           </devices>
         </domain>
         """
+    )
+
+    @classmethod
+    def _generate_domain_xml(
+        cls,
+        name: str,
+        vm_uuid: str,
+        vm_image: str,
+        memory_mb: int,
+        vcpus: int,
+    ) -> str:
+        """
+        Minimal domain XML definition suitable for QEMU/KVM style hypervisors.
+
+        The disk bypasses the host page cache (cache='none'), passes guest
+        TRIM through (discard='unmap') and, when USE_IO_URING is enabled,
+        submits I/O via io_uring instead of QEMU's thread-pool AIO. Disk
+        I/O runs on a dedicated iothread instead of QEMU's main loop, with
+        one virtio-blk queue per vCPU, and the guest sees the host CPU model
+        (host-passthrough).
+
+        String values are XML-escaped before substitution.
+        """
+        return cls._XML_TEMPLATE.substitute(
+            name=escape(name),
+            uuid=escape(vm_uuid),
+            memory_mb=int(memory_mb),
+            vcpus=int(vcpus),
+            vm_image=quoteattr(vm_image),
+        )
+
+    def _get_domain(self, name: str, conn: libvirt.virConnect):
+        """
+        Domain handle for `name` bound to `conn` (a connection borrowed via
+        _conn()), cached per connection while events keep the cache valid.
+        """
+        if self._events_enabled:
+            with self._cache_lock:
+                dom = self._dom_cache.get(name, {}).get(conn)
+            if dom is not None:
+                return dom
 
-    def _get_domain(self, name: str):
         try:
-            return self.conn.lookupByName(name)
+            dom = conn.lookupByName(name)
         except libvirt.libvirtError:
             raise HTTPException(status_code=404, detail=f"VM '{name}' not found")
 
+        if self._events_enabled:
+            with self._cache_lock:
+                # Only for known VMs; the undefine event evicts the handles
+                if name in self._vm_cache:
+                    self._dom_cache.setdefault(name, {})[conn] = dom
+        return dom
+
     # ------------------------------------------------------------------
     # Public VM operations
     # ------------------------------------------------------------------
@@ -160,7 +612,22 @@ class VMController:
         memory_mb: Optional[int] = None,
         vcpus: Optional[int] = None,
         owner: Optional[str] = None,
+        on_guest_ready: Optional[Callable[[str], None]] = None,
     ) -> Dict[str, Any]:
+        """
+        Clone the base image, define and boot a new VM.
+
+        If `on_guest_ready` is given and guest_ready_events is True, it is
+        called with the VM name (on the libvirt event thread) once the
+        guest agent inside the new VM has connected, i.e. the guest has
+        booted far enough to be provisioned.
+        """
+        if not _VALID_VM_NAME.fullmatch(name):
+            raise HTTPException(
+                status_code=400,
+                detail=f"Invalid VM name '{name}': use 1-64 letters, digits, '_' or '-'",
+            )
+
         if self.vm_exists(name):
             raise HTTPException(status_code=400, detail=f"VM '{name}' already exists")
 
@@ -177,28 +644,42 @@ class VMController:
             vcpus=vcpus,
         )
 
-        try:
-            dom = self.conn.defineXML(domain_xml)
-            if dom is None:
-                raise HTTPException(
-                    status_code=500,
-                    detail="Failed to define libvirt domain from XML",
+        with self._conn() as conn:
+            try:
+                dom = conn.defineXML(domain_xml)
+                if dom is None:
+                    raise HTTPException(
+                        status_code=500,
+                        detail="Failed to define libvirt domain from XML",
+                    )
+                if on_guest_ready is not None and self.guest_ready_events:
+                    # Registered before boot so the agent event can't be missed
+                    with self._cache_lock:
+                        self._guest_ready_callbacks[name] = on_guest_ready
+                dom.create()
+                if self._events_enabled:
+                    # Don't wait for the event so the VM is visible immediately
+                    self._cache_domain(dom)
+                log_event(
+                    "[vm] Created VM '%s' (owner=%s, memory=%sMiB, vcpus=%s, hypervisor=%s)",
+                    name,
+                    owner,
+                    memory_mb,
+                    vcpus,
+                    HYPERVISOR_TYPE,
                 )
-            dom.create()
-            log_event(
-                f"[vm] Created VM '{name}' (owner={owner}, memory={memory_mb}MiB, "
-                f"vcpus={vcpus}, hypervisor={HYPERVISOR_TYPE})"
-            )
-            return {
-                "name": name,
-                "uuid": vm_uuid,
-                "image": vm_image,
-                "memory_mb": memory_mb,
-                "vcpus": vcpus,
-                "owner": owner,
-            }
-        except libvirt.libvirtError as e:
-            raise HTTPException(status_code=500, detail=f"libvirt error: {e}") from e
+                return {
+                    "name": name,
+                    "uuid": vm_uuid,
+                    "image": vm_image,
+                    "memory_mb": memory_mb,
+                    "vcpus": vcpus,
+                    "owner": owner,
+                }
+            except libvirt.libvirtError as e:
+                with self._cache_lock:
+                    self._guest_ready_callbacks.pop(name, None)
+                raise HTTPException(status_code=500, detail=f"libvirt error: {e}") from e
 
     def start_vm(self, name: str) -> None:
         """
@@ -208,33 +689,34 @@ class VMController:
         - If paused -> resume.
         - If shut off / crashed / no state -> start.
         """
-        dom = self._get_domain(name)
-        try:
-            info = dom.info()
-            state = info[0]
+        with self._conn() as conn:
+            dom = self._get_domain(name, conn)
+            try:
+                info = dom.info()
+                state = info[0]
 
-            # libvirt states:
-            # 0: no state, 1: running, 2: blocked, 3: paused, 4: shutting down,
-            # 5: shut off, 6: crashed, 7: pmsuspended
-            if state == libvirt.VIR_DOMAIN_RUNNING:
-                raise HTTPException(
-                    status_code=409,
-                    detail=f"VM '{name}' is already running",
-                )
+                # libvirt states:
+                # 0: no state, 1: running, 2: blocked, 3: paused, 4: shutting down,
+                # 5: shut off, 6: crashed, 7: pmsuspended
+                if state == libvirt.VIR_DOMAIN_RUNNING:
+                    raise HTTPException(
+                        status_code=409,
+                        detail=f"VM '{name}' is already running",
+                    )
 
-            if state == libvirt.VIR_DOMAIN_PAUSED:
-                log_event(f"[vm] Resuming paused VM '{name}'")
-                dom.resume()
-                return
+                if state == libvirt.VIR_DOMAIN_PAUSED:
+                    log_event("[vm] Resuming paused VM '%s'", name)
+                    dom.resume()
+                    return
 
-            log_event(f"[vm] Starting VM '{name}' from state={state}")
-            dom.create()
+                log_event("[vm] Starting VM '%s' from state=%s", name, state)
+                dom.create()
 
-        except libvirt.libvirtError as e:
-            raise HTTPException(
-                status_code=500,
-                detail=f"Failed to start VM '{name}': {e}",
-            ) from e
+            except libvirt.libvirtError as e:
+                raise HTTPException(
+                    status_code=500,
+                    detail=f"Failed to start VM '{name}': {e}",
+                ) from e
 
     def stop_vm(self, name: str) -> None:
         """
@@ -245,185 +727,465 @@ class VMController:
         - Otherwise:
             1) Best-effort snapshot
             2) Try graceful shutdown (ACPI)
-            3) Wait a bit for it to actually stop
+            3) Wait (on a libvirt lifecycle event) for it to actually stop
             4) If still running, force poweroff with destroy()
+
+        libvirt rejects shutdown()/destroy() of an inactive domain with
+        VIR_ERR_OPERATION_INVALID, which covers a VM that stops between the
+        up-front state check (cached state, or one state() call when events
+        are unavailable) and the shutdown request.
         """
-        dom = self._get_domain(name)
+        with self._conn() as conn:
+            dom = self._get_domain(name, conn)
 
-        # Check current state first
-        try:
-            info = dom.info()
-            state = info[0]
-        except libvirt.libvirtError as e:
-            raise HTTPException(
-                status_code=500,
-                detail=f"Failed to inspect VM '{name}': {e}",
-            ) from e
+            # Don't snapshot VMs that are already off. The event-maintained
+            # cache knows the state without an RPC; without events a single
+            # state() call tells us.
+            if self._events_enabled:
+                with self._cache_lock:
+                    cached = self._vm_cache.get(name)
+                state = cached["state"] if cached is not None else None
+            else:
+                try:
+                    state = dom.state()[0]
+                except libvirt.libvirtError as e:
+                    raise HTTPException(status_code=500, detail=f"Failed to inspect VM '{name}': {e}") from e
+            if state == libvirt.VIR_DOMAIN_SHUTOFF:
+                log_event("[vm] stop_vm called for '%s' but it is already shut off – no-op", name)
+                return
 
-        if state == libvirt.VIR_DOMAIN_SHUTOFF:
-            # Already stopped -> this is fine, no error
-            log_event(f"[vm] stop_vm called for '{name}' but it is already shut off – no-op")
-            return
+            # Try snapshot only if VM is actually active-ish
+            try:
+                self.backup_manager.create_snapshot(vm_name=name)
+            except Exception as e:  # noqa: BLE001
+                log_event("[vm] Snapshot on stop failed for '%s': %s", name, e)
 
-        # Try snapshot only if VM is actually active-ish
-        try:
-            self.backup_manager.create_snapshot(vm_name=name)
-        except Exception as e:  # noqa: BLE001
-            log_event(f"[vm] Snapshot on stop failed for '{name}': {e}")
+            # Subscribe before asking for shutdown so the STOPPED event can't be missed
+            stopped = threading.Event()
+            callback_id = self._watch_for_stop(conn, dom, stopped)
+            timeout_sec = 15
 
-        # 1) Ask libvirt for graceful shutdown
-        try:
-            log_event(f"[vm] Graceful shutdown requested for VM '{name}' from state={state}")
-            dom.shutdown()
-        except libvirt.libvirtError as e:
-            log_event(f"[vm] Graceful shutdown failed for '{name}': {e}; will try forced destroy")
-            # Fall through to forced destroy below
+            try:
+                # 1) Ask libvirt for graceful shutdown
+                try:
+                    log_event("[vm] Graceful shutdown requested for VM '%s'", name)
+                    dom.shutdown()
+                except libvirt.libvirtError as e:
+                    if e.get_error_code() == libvirt.VIR_ERR_OPERATION_INVALID:
+                        # Already stopped -> this is fine, no error
+                        log_event("[vm] stop_vm called for '%s' but it is already shut off – no-op", name)
+                        return
+                    log_event("[vm] Graceful shutdown failed for '%s': %s; will try forced destroy", name, e)
+                    # Fall through to forced destroy below
 
-        # 2) Poll a bit to see if it actually turned off
-        timeout_sec = 15
-        interval = 1
-        waited = 0
+                # 2) Wait for it to actually turn off
+                if callback_id is not None:
+                    started = time.monotonic()
+                    if stopped.wait(timeout=timeout_sec):
+                        log_event(
+                            "[vm] VM '%s' gracefully shut off after %.2fs", name, time.monotonic() - started
+                        )
+                        return
+                else:
+                    # No event support on this connection -> poll the state.
+                    # Most guests are off within a second, so start polling
+                    # fast and back off towards 1s for slow ones.
+                    interval = 0.05
+                    waited = 0.0
+                    while waited < timeout_sec:
+                        if self._shutdown_state(dom, name) == libvirt.VIR_DOMAIN_SHUTOFF:
+                            log_event("[vm] VM '%s' gracefully shut off after %.2fs", name, waited)
+                            return
+                        time.sleep(interval)
+                        waited += interval
+                        interval = min(interval * 1.7, 1.0)
+            finally:
+                if callback_id is not None:
+                    try:
+                        conn.domainEventDeregisterAny(callback_id)
+                    except libvirt.libvirtError:
+                        pass
+
+            # 3) If we get here, graceful shutdown did not complete in time -> force destroy
+            log_event(
+                "[vm] VM '%s' did not shut down within %ss; attempting forced destroy()",
+                name,
+                timeout_sec,
+            )
 
-        while waited < timeout_sec:
             try:
-                info = dom.info()
-                curr_state = info[0]
+                dom.destroy()
+                log_event("[vm] VM '%s' forcefully powered off via destroy()", name)
+                return
             except libvirt.libvirtError as e:
+                if e.get_error_code() == libvirt.VIR_ERR_OPERATION_INVALID:
+                    # It stopped on its own after all (e.g. before we subscribed)
+                    log_event("[vm] VM '%s' shut off", name)
+                    return
+                # Only here we truly give up and return 500
                 raise HTTPException(
                     status_code=500,
-                    detail=f"Failed to inspect VM '{name}' during shutdown: {e}",
+                    detail=f"Failed to force stop VM '{name}': {e}",
                 ) from e
 
-            if curr_state == libvirt.VIR_DOMAIN_SHUTOFF:
-                log_event(f"[vm] VM '{name}' gracefully shut off after {waited}s")
-                return
+    def _watch_for_stop(self, conn, dom, stopped: threading.Event) -> Optional[int]:
+        """
+        Register a lifecycle callback for `dom` that sets `stopped` once the
+        domain reaches VIR_DOMAIN_EVENT_STOPPED. Returns the callback id to
+        deregister, or None if events are unavailable on this connection.
+        """
+        if not self._events_enabled:
+            return None
 
-            time.sleep(interval)
-            waited += interval
+        def on_event(conn, _dom, event, detail, opaque) -> None:
+            if event == libvirt.VIR_DOMAIN_EVENT_STOPPED:
+                stopped.set()
 
-        # 3) If we get here, graceful shutdown did not complete in time -> force destroy
-        log_event(
-            f"[vm] VM '{name}' did not shut down within {timeout_sec}s "
-            f"(last state={curr_state}); attempting forced destroy()"
-        )
+        try:
+            return conn.domainEventRegisterAny(
+                dom, libvirt.VIR_DOMAIN_EVENT_ID_LIFECYCLE, on_event, None
+            )
+        except libvirt.libvirtError:
+            return None
 
+    @staticmethod
+    def _shutdown_state(dom, name: str) -> int:
         try:
-            dom.destroy()
-            log_event(f"[vm] VM '{name}' forcefully powered off via destroy()")
-            return
+            return dom.info()[0]
         except libvirt.libvirtError as e:
-            # Only here we truly give up and return 500
             raise HTTPException(
                 status_code=500,
-                detail=f"Failed to force stop VM '{name}': {e}",
+                detail=f"Failed to inspect VM '{name}' during shutdown: {e}",
             ) from e
 
-    def delete_vm(self, name: str) -> None:
-        dom = self._get_domain(name)
+    def delete_vm(self, name: str, defer_disk_removal: bool = False) -> Optional[str]:
+        """
+        Destroy and undefine a VM and remove its disk.
 
-        # Ensure VM is off
-        try:
-            if dom.isActive():
+        Unlinking a large image can take a while, so with
+        `defer_disk_removal=True` the disk is only renamed out of the way
+        (freeing the name for a new VM immediately) and the renamed path is
+        returned for the caller to unlink later, e.g. after responding.
+        """
+        with self._conn() as conn:
+            dom = self._get_domain(name, conn)
+
+            # Ensure VM is off (destroy() of an inactive domain just fails)
+            try:
                 dom.destroy()
-        except libvirt.libvirtError:
-            pass
+            except libvirt.libvirtError:
+                pass
 
-        # Undefine domain and remove disk
-        try:
-            disk_path = str(VM_STORAGE_PATH / f"{name}.qcow2")
-            dom.undefineFlags(libvirt.VIR_DOMAIN_UNDEFINE_MANAGED_SAVE)
-            if os.path.exists(disk_path):
-                os.remove(disk_path)
-            log_event(f"[vm] Deleted VM '{name}', disk={disk_path}")
-        except libvirt.libvirtError as e:
-            raise HTTPException(status_code=500, detail=f"Failed to delete VM '{name}': {e}") from e
+            # Undefine domain and remove disk
+            try:
+                disk_path = str(VM_STORAGE_PATH / f"{name}.qcow2")
+                dom.undefineFlags(libvirt.VIR_DOMAIN_UNDEFINE_MANAGED_SAVE)
+                self._evict_domain(name)
+            except libvirt.libvirtError as e:
+                raise HTTPException(status_code=500, detail=f"Failed to delete VM '{name}': {e}") from e
 
-    def list_vms(self) -> List[Dict[str, Any]]:
-        domains = self.conn.listAllDomains()
-        vms: List[Dict[str, Any]] = []
-        for dom in domains:
+        if not os.path.exists(disk_path):
+            log_event("[vm] Deleted VM '%s', no disk at %s", name, disk_path)
+            return None
+
+        if defer_disk_removal:
+            trash_path = str(VM_STORAGE_PATH / f".{name}.qcow2.deleted-{uuid.uuid4().hex}")
+            os.replace(disk_path, trash_path)
+            log_event("[vm] Deleted VM '%s', disk=%s (pending removal as %s)", name, disk_path, trash_path)
+            return trash_path
+
+        os.remove(disk_path)
+        log_event("[vm] Deleted VM '%s', disk=%s", name, disk_path)
+        return None
+
+    def reset_vm(self, name: str) -> None:
+        """
+        Reset a shut-off VM's disk to the pristine base image.
+
+        stop_vm() leaves external snapshot overlays on top of the VM's own
+        image, and the domain's disk then points at the newest overlay. Those
+        overlays are discarded along with the data: the domain is pointed
+        back at VM_STORAGE_PATH/{name}.qcow2 first, then a fresh image is
+        renamed over that file (never seen half-written), and only then are
+        the now unreferenced overlay files removed. Every intermediate state
+        leaves the domain with a consistent disk. VMs with libvirt-tracked
+        snapshots are refused (409), as those still reference the overlays.
+        """
+        disk_path = VM_STORAGE_PATH / f"{name}.qcow2"
+        with self._conn() as conn:
+            dom = self._get_domain(name, conn)
             try:
-                info = dom.info()
-                vms.append(
-                    {
-                        "name": dom.name(),
-                        "id": dom.ID(),
-                        "state": info[0],
-                        "max_memory": info[1],
-                        "memory": info[2],
-                        "vcpus": info[3],
-                        "cpu_time": info[4],
-                    }
+                if dom.isActive():
+                    raise HTTPException(status_code=409, detail=f"VM '{name}' must be shut off to be reset")
+                if dom.snapshotNum(0):
+                    raise HTTPException(
+                        status_code=409,
+                        detail=f"VM '{name}' has snapshots; delete them before resetting",
+                    )
+                root = ElementTree.fromstring(dom.XMLDesc(0))
+            except libvirt.libvirtError as e:
+                raise HTTPException(status_code=500, detail=f"Failed to inspect VM '{name}': {e}") from e
+
+            disk = self._system_disk(root)
+            if disk is None:
+                raise HTTPException(status_code=500, detail=f"VM '{name}' has no file-backed disk to reset")
+            source = disk.find("source")
+            active_path = Path(source.get("file"))
+
+            # Files layered above base.qcow2 that belong to this VM, apart from
+            # its own image: the snapshot overlays dropped by the reset.
+            own = disk_path.resolve()
+            base = BASE_IMAGE_PATH.resolve()
+            storage = VM_STORAGE_PATH.resolve()
+            overlays = [
+                path
+                for path in (
+                    (active_path.parent / f).resolve() for f in self._backing_chain(name, active_path)
                 )
-            except libvirt.libvirtError:
-                continue
-        return vms
+                if path.parent == storage and path not in (own, base)
+            ]
+
+            tmp_path = VM_STORAGE_PATH / f".{name}.qcow2.reset-{uuid.uuid4().hex}"
+            self._write_image(name, tmp_path)
+            try:
+                if active_path.resolve() != own:
+                    # Detach the overlays before their backing file is replaced
+                    source.set("file", str(disk_path))
+                    for backing in disk.findall("backingStore"):
+                        disk.remove(backing)
+                    conn.defineXML(ElementTree.tostring(root, encoding="unicode"))
+                os.replace(tmp_path, disk_path)
+            except (OSError, libvirt.libvirtError) as e:
+                tmp_path.unlink(missing_ok=True)
+                raise HTTPException(status_code=500, detail=f"Failed to reset VM '{name}': {e}") from e
+
+        for path in overlays:
+            try:
+                path.unlink(missing_ok=True)
+            except OSError as e:
+                log_event("[vm] WARNING: could not remove overlay %s of VM '%s': %s", path, name, e)
+        log_event(
+            "[vm] Reset disk of VM '%s' to %s (dropped %s snapshot overlays)", name, BASE_IMAGE_PATH, len(overlays)
+        )
+
+    @staticmethod
+    def _system_disk(root: ElementTree.Element) -> Optional[ElementTree.Element]:
+        # First file-backed disk of the domain XML, i.e. the one we created
+        for disk in root.iterfind("./devices/disk[@device='disk']"):
+            source = disk.find("source")
+            if source is not None and source.get("file"):
+                return disk
+        return None
+
+    @staticmethod
+    def _backing_chain(name: str, image_path: Path) -> List[str]:
+        """File names of `image_path` and all its backing files, top first."""
+        cmd = ["qemu-img", "info", "--backing-chain", "--output=json", "-U", str(image_path)]
+        try:
+            result = subprocess.run(cmd, check=True, capture_output=True, close_fds=False)
+            return [image["filename"] for image in json.loads(result.stdout)]
+        except (OSError, ValueError, KeyError, subprocess.CalledProcessError) as e:
+            err = e.stderr.decode(errors="replace").strip() if getattr(e, "stderr", None) else str(e)
+            raise HTTPException(
+                status_code=500,
+                detail=f"Failed to inspect disk of VM '{name}': {err}",
+            ) from e
+
+    @staticmethod
+    def leftover_disks() -> List[Path]:
+        """
+        Disks that delete_vm(defer_disk_removal=True) renamed out of the way,
+        and partial images of interrupted resets, left behind by a crash or
+        restart. Only meaningful before any VM operation has started.
+        """
+        return [
+            path
+            for pattern in (".*.qcow2.deleted-*", ".*.qcow2.reset-*")
+            for path in VM_STORAGE_PATH.glob(pattern)
+        ]
+
+    @staticmethod
+    def remove_disks(paths: List[Path]) -> None:
+        for path in paths:
+            try:
+                path.unlink(missing_ok=True)
+            except OSError as e:
+                log_event("[vm] WARNING: could not remove leftover disk %s: %s", path, e)
+        log_event("[vm] Removed %s leftover disk image(s) from %s", len(paths), VM_STORAGE_PATH)
+
+    def list_vms(self) -> List[Dict[str, Any]]:
+        # Not served from _vm_cache: its memory/cpu_time figures are only as
+        # fresh as the last lifecycle event, and one bulk stats RPC gets
+        # live values for all domains.
+        with self._conn() as conn:
+            return [entry for _, entry in self._all_domain_info(conn)]
 
     # ------------------------------------------------------------------
     # VM configuration (Ansible)
     # ------------------------------------------------------------------
-    def configure_vm_with_ansible(self, vm_name: str) -> None:
+    async def configure_vm_with_ansible(self, vm_names: List[str]) -> Dict[str, str]:
         """
-        Run ansible playbook to configure the VM.
+        Run ansible playbook to configure one or more VMs in a single run.
+
+        Returns {vm_name: error} for the VMs the run failed on, according to
+        the PLAY RECAP; raises HTTPException if the run failed as a whole
+        (playbook missing, timeout, no per-host result to go by).
 
+        - All VMs are passed in one invocation (`target_hosts` as the play's
+          host pattern, `--forks`), so Ansible configures only them, in
+          parallel. `target_host` carries the same value for older playbooks.
         - Uses in-memory stored sudo/become password if provided via
           AnsibleAuthManager.
         - If no password is provided, it runs as usual, which works on
           hosts with passwordless sudo.
+        - Runs as an asyncio subprocess, so waiting for the playbook and
+          reading its output never blocks the event loop.
         """
+        targets = ",".join(vm_names)
         cmd = [
             "ansible-playbook",
             "-i",
             ANSIBLE_HOSTS_FILE,
             ANSIBLE_PLAYBOOK,
             "-e",
-            f"target_host={vm_name}",
+            f"target_hosts={targets}",
+            "-e",
+            f"target_host={targets}",
+            f"--forks={ANSIBLE_FORKS}",
         ]
 
         env = os.environ.copy()
+        # Fewer SSH round-trips per task and reuse of SSH connections, unless
+        # the operator's environment says otherwise (e.g. pipelining off for
+        # requiretty hosts, or ssh args with a ProxyJump). These variables
+        # take precedence over ansible.cfg, so settings kept there need to be
+        # exported instead.
+        env.setdefault("ANSIBLE_PIPELINING", "True")
+        env.setdefault("ANSIBLE_SSH_ARGS", "-o ControlMaster=auto -o ControlPersist=60s")
 
+        # If user provided password via /ansible/auth, pass it to Ansible via
+        # the environment only (read natively by the become plugin), so it
+        # never shows up in the process table as a command-line argument.
         become_password = AnsibleAuthManager.get_password()
-        extra: list[str] = []
-
-        # If user provided password via /ansible/auth, pass it to Ansible
         if become_password:
+            env["ANSIBLE_BECOME_PASS"] = become_password
             env["ANSIBLE_BECOME_PASSWORD"] = become_password
-            extra.extend(
-                [
-                    "-e",
-                    f"ansible_become_pass={become_password}",
-                ]
-            )
 
-        full_cmd = cmd + extra
-        log_event(f"[ansible] Running playbook for VM {vm_name}: {' '.join(cmd)}")
+        log_event("[ansible] Running playbook for VMs %s: %s", targets, " ".join(cmd))
 
         try:
-            result = subprocess.run(
-                full_cmd,
-                capture_output=True,
-                text=True,
+            proc = await asyncio.create_subprocess_exec(
+                *cmd,
                 env=env,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.STDOUT,
+                close_fds=False,
             )
         except FileNotFoundError as e:
             msg = f"ansible-playbook not found: {e}"
-            log_event(f"[ansible] {msg}")
+            log_event("[ansible] %s", msg)
             raise HTTPException(
                 status_code=500,
                 detail=f"Ansible configuration failed: {msg}",
             )
 
-        if result.returncode != 0:
-            stderr = (result.stderr or "").strip()
-            stdout = (result.stdout or "").strip()
-            combined = "\n".join(part for part in [stderr, stdout] if part) or "unknown error"
-            log_event(f"[ansible] FAILED for VM {vm_name}: {combined}")
+        # Stream output into the log as it is produced; only the last lines
+        # are kept in memory for the error message.
+        tail: deque[str] = deque(maxlen=50)
+        # host -> (unreachable, failed) from the PLAY RECAP, and the last
+        # task failure line reported for each host
+        recap: Dict[str, tuple] = {}
+        host_errors: Dict[str, str] = {}
+        saw_recap = False
+
+        def handle_line(raw: bytes) -> None:
+            nonlocal saw_recap
+            line = raw.decode(errors="replace").rstrip()
+            if line:
+                tail.append(line)
+                log_event("[ansible] %s | %s", targets, line)
+                if line.startswith("PLAY RECAP"):
+                    saw_recap = True
+                elif saw_recap and (m := _ANSIBLE_RECAP.match(line)):
+                    recap[m[1]] = (int(m[2]), int(m[3]))
+                elif m := _ANSIBLE_FAILURE.match(line):
+                    host_errors[m[1]] = line
+
+        async def pump_output() -> None:
+            # Split lines here rather than with readline(), which gives up on
+            # lines over the stream limit; the pipe must keep being drained
+            # or the playbook blocks writing to it.
+            buf = b""
+            skipping = False  # inside the cut-off rest of an overlong line
+            while chunk := await proc.stdout.read(_ANSIBLE_READ_SIZE):
+                *lines, buf = (buf + chunk).split(b"\n")
+                for raw in lines:
+                    if skipping:
+                        skipping = False
+                    else:
+                        handle_line(raw)
+                if len(buf) > _ANSIBLE_MAX_LINE:
+                    if not skipping:
+                        handle_line(buf[:_ANSIBLE_MAX_LINE])
+                        skipping = True
+                    buf = b""
+            if buf and not skipping:
+                handle_line(buf)
+
+        reader = asyncio.create_task(pump_output())
+
+        self._ansible_procs.add(proc)
+        timed_out = False
+        try:
+            returncode = await asyncio.wait_for(proc.wait(), ANSIBLE_TIMEOUT)
+        except asyncio.TimeoutError:
+            timed_out = True
+            log_event("[ansible] Playbook for VMs %s exceeded %ss, terminating", targets, ANSIBLE_TIMEOUT)
+            proc.terminate()
+            returncode = await proc.wait()
+            tail.append(f"timed out after {ANSIBLE_TIMEOUT}s")
+        finally:
+            self._ansible_procs.discard(proc)
+            await reader
+
+        failed: Dict[str, str] = {}
+        if saw_recap:
+            for name in vm_names:
+                if name not in recap:
+                    failed[name] = "host not matched by the Ansible inventory"
+                elif any(recap[name]):
+                    unreachable, failures = recap[name]
+                    failed[name] = host_errors.get(name, f"unreachable={unreachable} failed={failures}")
+
+        if returncode != 0 and (not saw_recap or not failed or timed_out):
+            combined = "\n".join(tail) or "unknown error"
+            log_event("[ansible] FAILED for VMs %s (exit code %s)", targets, returncode)
             raise HTTPException(
                 status_code=500,
                 detail=f"Ansible configuration failed: {combined}",
             )
 
-        log_event(f"[ansible] VM {vm_name} configured successfully")
+        if failed:
+            log_event("[ansible] FAILED for VMs %s: %s", ",".join(failed), failed)
+        if len(failed) < len(vm_names):
+            log_event(
+                "[ansible] VMs %s configured successfully",
+                ",".join(name for name in vm_names if name not in failed),
+            )
+        return failed
+
+    def cancel_ansible_runs(self) -> int:
+        """
+        Terminate all running ansible-playbook processes started by
+        configure_vm_with_ansible(). Returns how many were signalled.
+        Must be called from the event loop the playbooks run on.
+        """
+        procs = list(self._ansible_procs)
+        for proc in procs:
+            proc.terminate()
+        if procs:
+            log_event("[ansible] Terminated %s running playbook(s)", len(procs))
+        return len(procs)
 
     # ------------------------------------------------------------------
     # SSH helper – used by WebSocket tunnel
@@ -438,13 +1200,14 @@ class VMController:
         }
 
     def get_vm_state(self, name: str) -> dict:
-        dom = self._get_domain(name)
-        info = dom.info()
-        return {
-            "name": name,
-            "state": info[0],
-            "max_memory": info[1],
-            "memory": info[2],
-            "vcpus": info[3],
-            "cpu_time": info[4],
-        }
+        with self._conn() as conn:
+            dom = self._get_domain(name, conn)
+            info = dom.info()
+            return {
+                "name": name,
+                "state": info[0],
+                "max_memory": info[1],
+                "memory": info[2],
+                "vcpus": info[3],
+                "cpu_time": info[4],
+            }
@@ -1,47 +1,75 @@
 import asyncio
-import json
+import codecs
+import os
+import secrets
+import struct
 import time
-import uuid
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import asynccontextmanager
+from functools import partial
 from typing import Optional
 
 import asyncssh
+import orjson
 from fastapi import (
+    BackgroundTasks,
+    Depends,
     FastAPI,
     HTTPException,
     WebSocket,
     WebSocketDisconnect,
     Request,
 )
+from fastapi.exceptions import RequestValidationError
 from fastapi.responses import JSONResponse, Response
-from pydantic import BaseModel
+from pydantic import BaseModel, Field, ValidationError
 from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
 
-from config.settings import METRICS_ENABLED, SSH_LOG_DIR
+from config.settings import GUEST_AGENT_TIMEOUT, LIBVIRT_POOL_SIZE, METRICS_ENABLED
 from core.vm_controller import VMController
 from core.pool_manager import PoolManager
 from core.metrics import (
-    REQUEST_COUNT,
-    REQUEST_LATENCY,
+    record_ansible_result,
+    record_request,
     record_vm_created,
     record_vm_deleted,
     record_vm_activity,
     record_ssh_session_change,
     init_static_metrics,
     start_background_collectors,
+    stop_background_collectors,
 )
 from core.logger import log_event
 from core.ansible_auth import AnsibleAuthManager
+from core.ansible_batcher import AnsibleBatcher
+from core.ssh_pool import SSHConnectionPool
+from core.cast_recorder import CastRecorder
 from schemas.vm_schema import VMCreateSchema
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
+    global _status_events_enabled
+    loop = asyncio.get_running_loop()
+    # libvirt event thread -> event loop; wakes status websockets of that VM
+    _status_events_enabled = vm_controller.subscribe_state_changes(
+        lambda name: loop.call_soon_threadsafe(_notify_status_watchers, name)
+    )
+    # Disks of VMs deleted just before a crash/restart. They are listed
+    # before serving requests, but unlinking large images can take a while,
+    # so startup doesn't wait for that.
+    leftover_disks = vm_controller.leftover_disks()
+    if leftover_disks:
+        loop.run_in_executor(vm_ops_executor, vm_controller.remove_disks, leftover_disks)
     if METRICS_ENABLED:
         init_static_metrics()
         start_background_collectors()
         log_event("[app] Metrics enabled and collectors started")
     yield
+    vm_ops_executor.shutdown(wait=False, cancel_futures=True)
+    await ssh_pool.close_all()
+    if METRICS_ENABLED:
+        stop_background_collectors()
 
 
 app = FastAPI(
@@ -61,62 +89,159 @@ app = FastAPI(
 
 vm_controller = VMController()
 pool_manager = PoolManager(vm_controller)
+ansible_batcher = AnsibleBatcher(vm_controller)
+ssh_pool = SSHConnectionPool()
+
+# Long-running VM lifecycle operations (image cloning, waiting for guest
+# shutdown, ...) get their own threads, so they can't starve the default
+# executor that serves the quick queries (list, state, metrics). They hold a
+# pooled libvirt connection for their whole duration, so there are fewer
+# workers than pooled connections: at least two stay free for those queries.
+vm_ops_executor = ThreadPoolExecutor(max_workers=max(LIBVIRT_POOL_SIZE - 2, 1), thread_name_prefix="vm-ops")
+
+
+async def _run_vm_op(func, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(vm_ops_executor, partial(func, *args, **kwargs))
 
 
 class AnsibleAuthSchema(BaseModel):
-    password: str
+    # Up to 4 UTF-8 bytes per character must fit AnsibleAuthManager's buffer
+    password: str = Field(..., max_length=1024)
 
 
-@app.middleware("http")
-async def metrics_middleware(request: Request, call_next):
-    endpoint = request.url.path
-    method = request.method
+# Health check, docs and the scrape endpoint itself aren't worth measuring
+_METRICS_EXCLUDED_PATHS = frozenset({"/", "/metrics", "/docs", "/redoc", "/openapi.json"})
 
-    if not METRICS_ENABLED or endpoint == "/metrics":
+
+async def metrics_middleware(request: Request, call_next):
+    if request.scope["path"] in _METRICS_EXCLUDED_PATHS:
         return await call_next(request)
 
-    start_time = time.time()
+    start_time = time.perf_counter()
     try:
         response = await call_next(request)
         return response
     finally:
-        duration = time.time() - start_time
-        REQUEST_COUNT.labels(method=method, endpoint=endpoint).inc()
-        REQUEST_LATENCY.labels(endpoint=endpoint).observe(duration)
+        duration = time.perf_counter() - start_time
+        # Label by route template (/vms/start/{name}), set by the router
+        # once matched; unmatched paths share one label.
+        route = request.scope.get("route")
+        endpoint = route.path if route is not None else "<unmatched>"
+        record_request(request.method, endpoint, duration)
+
+
+if METRICS_ENABLED:
+    # Registered only when metrics are on, rather than checked per request
+    app.middleware("http")(metrics_middleware)
 
 
 @app.get("/", tags=["System"])
-def root():
+async def root():
     return {
         "message": "Virtual Manager API is running",
         "version": app.version,
     }
 
 
-@app.post("/vms/create", tags=["VM Management"])
-def create_vm(payload: VMCreateSchema):
+# Background provisioning runs started by guest agent events; referenced here
+# so the tasks are not garbage collected while running.
+_provisioning_tasks: set[asyncio.Task] = set()
+
+# Ansible outcome per created VM ("pending" -> "running" -> "succeeded" /
+# "failed"), served by GET /vms/{name}/ansible-status.
+_ansible_status: dict[str, dict] = {}
+
+
+async def _provision_vm(name: str) -> None:
+    _ansible_status[name] = {"status": "running"}
+    try:
+        await ansible_batcher.configure(name)
+    except Exception as e:  # noqa: BLE001
+        error = e.detail if isinstance(e, HTTPException) else str(e)
+        log_event("[ansible] Provisioning of VM %s failed: %s", name, error)
+        _ansible_status[name] = {"status": "failed", "error": error}
+        record_ansible_result("failed")
+    else:
+        _ansible_status[name] = {"status": "succeeded"}
+        record_ansible_result("succeeded")
+
+
+def _start_provisioning(name: str) -> None:
+    task = asyncio.create_task(_provision_vm(name))
+    _provisioning_tasks.add(task)
+    task.add_done_callback(_provisioning_tasks.discard)
+
+
+def _guest_agent_timeout(name: str) -> None:
+    # The guest agent never came online (not installed in the image, or the
+    # guest is slow to boot): provision anyway rather than staying pending.
+    if vm_controller.cancel_guest_ready(name):
+        log_event(
+            "[ansible] No guest agent event for VM %s within %ss, provisioning anyway",
+            name,
+            GUEST_AGENT_TIMEOUT,
+        )
+        _start_provisioning(name)
+
+
+async def _vm_create_payload(request: Request) -> VMCreateSchema:
+    # Validate straight from the raw body with pydantic-core's JSON parser
+    # instead of FastAPI's json.loads() + dict validation.
     try:
-        vm_info = vm_controller.create_vm(
+        return VMCreateSchema.model_validate_json(await request.body())
+    except ValidationError as e:
+        # Same error locations FastAPI reports for a body parameter
+        errors = [{**err, "loc": ("body", *err["loc"])} for err in e.errors(include_url=False)]
+        raise RequestValidationError(errors) from e
+
+
+@app.post(
+    "/vms/create",
+    tags=["VM Management"],
+    # The body is parsed by _vm_create_payload, so describe it for the docs
+    openapi_extra={
+        "requestBody": {
+            "required": True,
+            "content": {"application/json": {"schema": VMCreateSchema.model_json_schema()}},
+        }
+    },
+)
+async def create_vm(
+    background_tasks: BackgroundTasks,
+    payload: VMCreateSchema = Depends(_vm_create_payload),
+):
+    loop = asyncio.get_running_loop()
+
+    def on_guest_ready(name: str) -> None:
+        # Called on the libvirt event thread once the guest has booted
+        loop.call_soon_threadsafe(_start_provisioning, name)
+
+    try:
+        vm_info = await _run_vm_op(
+            vm_controller.create_vm,
             name=payload.name,
             memory_mb=payload.memory_mb,
             vcpus=payload.vcpus,
             owner=payload.owner,
+            on_guest_ready=on_guest_ready,
         )
-        try:
-            vm_controller.configure_vm_with_ansible(payload.name)
-            status = "created"
-            ansible_error = None
-        except HTTPException as e:
-            status = "created_with_ansible_error"
-            ansible_error = e.detail
+        # Ansible never runs on the request path; poll
+        # GET /vms/{name}/ansible-status for the outcome.
+        _ansible_status[payload.name] = {"status": "pending"}
+        if not vm_controller.guest_ready_events:
+            # No guest agent events: start right after responding. Otherwise
+            # on_guest_ready() starts it once the guest has booted, or
+            # _guest_agent_timeout() after GUEST_AGENT_TIMEOUT seconds.
+            background_tasks.add_task(_provision_vm, payload.name)
+        else:
+            loop.call_later(GUEST_AGENT_TIMEOUT, _guest_agent_timeout, payload.name)
 
         record_vm_created(payload.owner)
         content = {
-            "status": status,
+            "status": "provisioning",
             "vm": vm_info,
         }
-        if ansible_error:
-            content["ansible_error"] = ansible_error
         return JSONResponse(status_code=201, content=content)
     except HTTPException:
         raise
@@ -125,9 +250,9 @@ def create_vm(payload: VMCreateSchema):
 
 
 @app.post("/vms/start/{name}", tags=["VM Management"])
-def start_vm(name: str, owner: Optional[str] = None):
+async def start_vm(name: str, owner: Optional[str] = None):
     try:
-        vm_controller.start_vm(name)
+        await _run_vm_op(vm_controller.start_vm, name)
         record_vm_activity(owner)
         return {"status": "started", "vm_name": name}
     except HTTPException as e:
@@ -137,9 +262,9 @@ def start_vm(name: str, owner: Optional[str] = None):
 
 
 @app.post("/vms/stop/{name}", tags=["VM Management"])
-def stop_vm(name: str, owner: Optional[str] = None):
+async def stop_vm(name: str, owner: Optional[str] = None):
     try:
-        vm_controller.stop_vm(name)
+        await _run_vm_op(vm_controller.stop_vm, name)
         record_vm_activity(owner)
         return {"status": "stopped", "vm_name": name}
     except HTTPException as e:
@@ -149,9 +274,13 @@ def stop_vm(name: str, owner: Optional[str] = None):
 
 
 @app.delete("/vms/delete/{name}", tags=["VM Management"])
-def delete_vm(name: str, owner: Optional[str] = None):
+async def delete_vm(name: str, background_tasks: BackgroundTasks, owner: Optional[str] = None):
     try:
-        vm_controller.delete_vm(name)
+        trash_path = await _run_vm_op(vm_controller.delete_vm, name, True)
+        _ansible_status.pop(name, None)
+        if trash_path:
+            # Free the disk's blocks after the response has been sent
+            background_tasks.add_task(os.unlink, trash_path)
         record_vm_deleted(owner)
         return {"status": "deleted", "vm_name": name}
     except HTTPException:
@@ -160,10 +289,30 @@ def delete_vm(name: str, owner: Optional[str] = None):
         raise HTTPException(status_code=400, detail=str(e))
 
 
+@app.get("/vms/{name}/ansible-status", tags=["Ansible"])
+async def get_ansible_status(name: str):
+    status = _ansible_status.get(name)
+    if status is None:
+        raise HTTPException(status_code=404, detail=f"No Ansible run recorded for VM '{name}'")
+    return {"vm_name": name, **status}
+
+
+@app.post("/vms/reset/{name}", tags=["VM Management"])
+async def reset_vm(name: str, owner: Optional[str] = None):
+    try:
+        await _run_vm_op(vm_controller.reset_vm, name)
+        record_vm_activity(owner)
+        return {"status": "reset", "vm_name": name}
+    except HTTPException:
+        raise
+    except Exception as e:  # noqa: BLE001
+        raise HTTPException(status_code=400, detail=str(e))
+
+
 @app.get("/vms/list", tags=["VM Management"])
-def list_vms():
+async def list_vms():
     try:
-        vms = vm_controller.list_vms()
+        vms = await asyncio.to_thread(vm_controller.list_vms)
         return {"vms": vms}
     except HTTPException:
         raise
@@ -172,74 +321,189 @@ def list_vms():
 
 
 @app.get("/pool/status", tags=["Pool"])
-def get_pool_status():
-    return pool_manager.get_pool_status()
+async def get_pool_status():
+    return await asyncio.to_thread(pool_manager.get_pool_status)
 
 
 @app.post("/pool/allocate", tags=["Pool"])
-def allocate_from_pool():
-    name = pool_manager.get_available_vm()
+async def allocate_from_pool():
+    # May recreate and stop a pool VM, so it runs as a lifecycle operation
+    name = await _run_vm_op(pool_manager.get_available_vm)
     if not name:
         raise HTTPException(status_code=503, detail="No available VM in pool")
     return {"vm_name": name}
 
 
 @app.post("/ansible/auth", tags=["Ansible"])
-def set_ansible_password(payload: AnsibleAuthSchema):
+async def set_ansible_password(payload: AnsibleAuthSchema):
     AnsibleAuthManager.set_password(payload.password)
     return {"status": "ok", "message": "Ansible sudo password stored in memory"}
 
 
 @app.post("/ansible/clear", tags=["Ansible"])
-def clear_ansible_password():
+async def clear_ansible_password():
     AnsibleAuthManager.clear_password()
     return {"status": "ok", "message": "Ansible sudo password cleared"}
 
 
+@app.post("/ansible/cancel", tags=["Ansible"])
+async def cancel_ansible_runs():
+    cancelled = vm_controller.cancel_ansible_runs()
+    return {"status": "ok", "cancelled": cancelled}
+
+
+# Rendered /metrics payload, reused by scrapes within METRICS_CACHE_TTL
+METRICS_CACHE_TTL = 0.5
+_metrics_cache: tuple[float, bytes] = (float("-inf"), b"")
+_metrics_lock = asyncio.Lock()
+
+
 @app.get("/metrics", tags=["Monitoring"])
-def metrics():
+async def metrics():
+    global _metrics_cache
     if not METRICS_ENABLED:
         raise HTTPException(status_code=404, detail="Metrics disabled")
-    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+    # Concurrent scrapes wait for a single render instead of each doing one
+    async with _metrics_lock:
+        rendered_at, payload = _metrics_cache
+        if time.monotonic() - rendered_at >= METRICS_CACHE_TTL:
+            payload = await asyncio.to_thread(generate_latest)
+            _metrics_cache = (time.monotonic(), payload)
+    return Response(payload, media_type=CONTENT_TYPE_LATEST)
+
+
+# Status websocket clients per VM name, woken on that VM's lifecycle events
+_status_watchers: dict[str, set[asyncio.Event]] = {}
+_status_events_enabled = False
+
+# Without state changes, status clients get a small keepalive frame this often
+STATUS_KEEPALIVE_INTERVAL = 30.0
+STATUS_POLL_INTERVAL = 1.0
+
+# ?format=binary status frames: state, vcpus, max_memory, memory (KiB) and
+# cpu_time (ns) as little-endian u8, u16, u64, u64, u64 (27 bytes). An empty
+# binary frame is the keepalive.
+_STATUS_FRAME = struct.Struct("<BHQQQ")
+
+
+def _encode_status(state: dict) -> bytes:
+    return _STATUS_FRAME.pack(
+        state["state"], state["vcpus"], state["max_memory"], state["memory"], state["cpu_time"]
+    )
+
+
+def _notify_status_watchers(name: str) -> None:
+    for event in _status_watchers.get(name, ()):
+        event.set()
 
 
 @app.websocket("/ws/vm/{name}/status")
 async def vm_status_stream(websocket: WebSocket, name: str):
+    binary = websocket.query_params.get("format") == "binary"
     await websocket.accept()
-    log_event(f"[ws-status] Client connected for VM {name}")
+    log_event("[ws-status] Client connected for VM %s", name)
+    changed = asyncio.Event()
+    _status_watchers.setdefault(name, set()).add(changed)
     try:
         while True:
-            state = vm_controller.get_vm_state(name)
-            await websocket.send_text(json.dumps(state))
-            await asyncio.sleep(1.0)
+            state = await asyncio.to_thread(vm_controller.get_vm_state, name)
+            if binary:
+                await websocket.send_bytes(_encode_status(state))
+            else:
+                await websocket.send_text(orjson.dumps(state).decode())
+            if not _status_events_enabled:
+                # Hypervisor without lifecycle events -> poll
+                await asyncio.sleep(STATUS_POLL_INTERVAL)
+                continue
+            # Sleep until the VM's state actually changes
+            while True:
+                try:
+                    await asyncio.wait_for(changed.wait(), STATUS_KEEPALIVE_INTERVAL)
+                    break
+                except asyncio.TimeoutError:
+                    if binary:
+                        await websocket.send_bytes(b"")
+                    else:
+                        await websocket.send_text('{"keepalive": true}')
+            changed.clear()
     except WebSocketDisconnect:
-        log_event(f"[ws-status] Client disconnected for VM {name}")
+        log_event("[ws-status] Client disconnected for VM %s", name)
     except Exception as e:  # noqa: BLE001
-        log_event(f"[ws-status] Error for VM {name}: {e}")
+        log_event("[ws-status] Error for VM %s: %s", name, e)
         await websocket.close()
+    finally:
+        watchers = _status_watchers.get(name)
+        if watchers is not None:
+            watchers.discard(changed)
+            if not watchers:
+                del _status_watchers[name]
+
+
+# SSH output is pumped to the browser in chunks of up to SSH_READ_SIZE bytes,
+# browser input to SSH in writes of up to SSH_STDIN_BATCH bytes. Neither side
+# waits for more data: whatever is already pending is sent together, anything
+# else goes out immediately.
+SSH_READ_SIZE = 64 * 1024
+SSH_STDIN_BATCH = 4 * 1024
 
 
 async def _proxy_websocket_to_ssh(
     websocket: WebSocket,
     ssh_process: asyncssh.SSHClientProcess,
-    log_file,
+    recorder: CastRecorder,
 ):
-    async for message in websocket.iter_text():
-        timestamp = time.time()
-        log_file.write(json.dumps([timestamp, "i", message]) + "\n")
-        ssh_process.stdin.write(message)
-        await ssh_process.stdin.drain()
+    # Frames are received by a separate task, so frames that arrive while a
+    # write is draining are batched into the next write.
+    inbox: asyncio.Queue = asyncio.Queue()
+
+    async def receive() -> None:
+        try:
+            async for message in websocket.iter_text():
+                recorder.record_input(message)
+                inbox.put_nowait(message.encode())
+        finally:
+            inbox.put_nowait(None)
+
+    receiver = asyncio.create_task(receive())
+    stdin = ssh_process.stdin
+    try:
+        eof = False
+        while not eof:
+            buf = bytearray()
+            data = await inbox.get()
+            while data is not None:
+                buf += data
+                if len(buf) >= SSH_STDIN_BATCH or inbox.empty():
+                    break
+                data = inbox.get_nowait()
+            eof = data is None
+            if buf:
+                stdin.write(bytes(buf))
+                await stdin.drain()
+    finally:
+        receiver.cancel()
+    # Re-raise receive errors (a disconnect just ends iter_text())
+    await receiver
 
 
 async def _proxy_ssh_to_websocket(
     websocket: WebSocket,
     ssh_process: asyncssh.SSHClientProcess,
-    log_file,
+    recorder: CastRecorder,
+    binary: bool = False,
 ):
-    async for data in ssh_process.stdout:
-        timestamp = time.time()
-        log_file.write(json.dumps([timestamp, "o", data]) + "\n")
-        await websocket.send_text(data)
+    # Text frames unless the client asked for ?format=binary; keep UTF-8
+    # sequences split across reads intact when decoding.
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    # read() returns everything already buffered (up to SSH_READ_SIZE), so
+    # output that arrived while the previous frame was sent shares a frame.
+    while data := await ssh_process.stdout.read(SSH_READ_SIZE):
+        recorder.record_output(data)
+        if binary:
+            # The browser terminal gets the raw bytes, no re-encoding
+            await websocket.send_bytes(data)
+        elif text := decoder.decode(data):
+            await websocket.send_text(text)
 
 
 @app.websocket("/ws/vm/{name}/terminal")
@@ -248,70 +512,79 @@ async def vm_terminal(
     name: str,
 ):
     owner = websocket.query_params.get("owner", None)
+    binary = websocket.query_params.get("format") == "binary"
 
     await websocket.accept()
     record_ssh_session_change(owner, name, +1)
 
-    session_id = str(uuid.uuid4())
-    log_path = SSH_LOG_DIR / f"{session_id}.cast"
+    session_id = secrets.token_hex(16)
 
-    log_event(f"[ws-ssh] New SSH WebSocket session {session_id} for VM {name}, owner={owner}")
+    log_event("[ws-ssh] New SSH WebSocket session %s for VM %s, owner=%s", session_id, name, owner)
 
     ssh_target = vm_controller.get_vm_ssh_target(name)
-    key_path = ssh_target.get("key_path")
 
     start_time = time.time()
 
-    with open(log_path, "w", encoding="utf-8") as f:
-        header = {
-            "version": 2,
-            "width": 80,
-            "height": 24,
-            "timestamp": int(start_time),
-            "env": {
-                "TERM": "xterm-256color",
-                "SHELL": "/bin/bash",
-            },
-            "vm_name": name,
-            "owner": owner,
-        }
-        f.write(json.dumps(header) + "\n")
-
-        try:
-            conn = await asyncssh.connect(
-                host=ssh_target["host"],
-                port=ssh_target["port"],
-                username=ssh_target["username"],
-                client_keys=[key_path] if key_path else None,
-                known_hosts=None,
-            )
-            process = await conn.create_process()
+    header = {
+        "version": 2,
+        "width": 80,
+        "height": 24,
+        "timestamp": int(start_time),
+        "env": {
+            "TERM": "xterm-256color",
+            "SHELL": "/bin/bash",
+        },
+        "vm_name": name,
+        "owner": owner,
+    }
+    recorder = CastRecorder(f"{session_id}.cast", header)
 
-            proxy_in = asyncio.create_task(_proxy_websocket_to_ssh(websocket, process, f))
-            proxy_out = asyncio.create_task(_proxy_ssh_to_websocket(websocket, process, f))
+    conn = None
+    process = None
+    try:
+        # Sessions to the same VM/user share one SSH connection
+        conn = await ssh_pool.acquire(ssh_target)
+        # Raw bytes from SSH; _proxy_ssh_to_websocket() decodes for text frames
+        process = await conn.create_process(encoding=None)
 
+        proxy_in = asyncio.create_task(_proxy_websocket_to_ssh(websocket, process, recorder))
+        proxy_out = asyncio.create_task(_proxy_ssh_to_websocket(websocket, process, recorder, binary))
+        try:
             await asyncio.wait(
                 [proxy_in, proxy_out],
                 return_when=asyncio.FIRST_COMPLETED,
             )
-
-        except asyncssh.Error as e:
-            error_msg = f"[ws-ssh] SSH error for VM {name}: {e}"
-            log_event(error_msg)
-            await websocket.send_text(error_msg)
-        except WebSocketDisconnect:
-            log_event(f"[ws-ssh] WebSocket disconnect for VM {name}")
-        except Exception as e:  # noqa: BLE001
-            log_event(f"[ws-ssh] Unexpected error for VM {name}: {e}")
         finally:
-            record_ssh_session_change(owner, name, -1)
-            record_vm_activity(owner)
-            try:
-                await websocket.close()
-            except Exception:  # noqa: BLE001
-                pass
-
-            log_event(
-                f"[ws-ssh] Session {session_id} closed for VM {name}, "
-                f"log={log_path}"
-            )
+            # Whichever direction ended first ends the session: cancel the
+            # other one and wait until it has actually finished.
+            proxy_in.cancel()
+            proxy_out.cancel()
+            results = await asyncio.gather(proxy_in, proxy_out, return_exceptions=True)
+
+        # Surface a proxy failure to the handlers below instead of dropping it
+        for result in results:
+            if isinstance(result, Exception):
+                raise result
+
+    except asyncssh.Error as e:
+        log_event("[ws-ssh] SSH error for VM %s: %s", name, e)
+        await websocket.send_text(f"[ws-ssh] SSH error for VM {name}: {e}")
+    except WebSocketDisconnect:
+        log_event("[ws-ssh] WebSocket disconnect for VM %s", name)
+    except Exception as e:  # noqa: BLE001
+        log_event("[ws-ssh] Unexpected error for VM %s: %s", name, e)
+    finally:
+        recorder.close()
+        if process is not None:
+            # Only this session's channel; the connection stays pooled
+            process.close()
+        if conn is not None:
+            ssh_pool.release(ssh_target)
+        record_ssh_session_change(owner, name, -1)
+        record_vm_activity(owner)
+        try:
+            await websocket.close()
+        except Exception:  # noqa: BLE001
+            pass
+
+        log_event("[ws-ssh] Session %s closed for VM %s, log=%s", session_id, name, recorder.path)